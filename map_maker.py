@@ -1,55 +1,280 @@
 """
 Minimal offline dungeon generator.
 Usage: python dungeon_gen.py <floor.xml> [+flags...]
+       python dungeon_gen.py --layers <floor.xml> [+flags...]
+       python dungeon_gen.py --batch <dir or glob> [--seeds 0-99] [--flags "+flags..."] [--out dir] [--jobs N]
+       python dungeon_gen.py --sweep <floor.xml> [--seeds 0-999] [--nopatches] [--json out.json]
+       python dungeon_gen.py --check-parity <floor.xml> [--seeds 0-99]
+       python dungeon_gen.py --bench-encoding <floor.xml> [--seeds 0-9] [--flags "+flags..."]
 """
 
-import sys, os, random
-from xml.etree import ElementTree
+import sys, os, random, glob, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from typing import Optional, List, Tuple
 
 # --- Import all necessary dungeon modules ---
-from skytemple_files.dungeon_data.mappa_bin.mappa_xml import mappa_floor_from_xml
-from skytemple_files.common.ppmdu_config.xml_reader import Pmd2XmlReader
 from skytemple_rust.st_dma import Dma
 from skytemple_rust.st_dpc import Dpc
 from skytemple_rust.st_dpci import Dpci
 from skytemple_rust.st_dpl import Dpl
 from skytemple_rust.st_dpla import Dpla
-from specific.eos_dungeons import Options, dungeon_data_files, generate_floor, DtefProvider, ExplorersDtefImporter
-
-# --- Load static data once ---
-STATIC = Pmd2XmlReader.load_default()
-ITEMS_BY_NAME = {x.name: x for x in STATIC.dungeon_data.item_categories.values()}
+from skytemple_files.common.dungeon_floor_generator.generator import SIZE_X, SIZE_Y
+from skytemple_files.dungeon_data.fixed_bin.model import FixedFloor
+from specific.eos_dungeons import Options, generate_floor, load_tileset, sweep_seeds, LayoutSummary, \
+    CompiledFloor, FLOOR_CACHE, FixedRoomDrawer, generate_layout, dma_mappings_match, draw_floor, encode_surface, \
+    ENCODINGS, ENCODING_EXTENSIONS, draw_floor_layers, generate_floor_layers, RENDER_CACHE, render_cache_key, \
+    tileset_cache_key
 
 # --- Main generation function ---
 def generate_map(xml_path, flags=[]):
     if not os.path.exists(xml_path):
         raise FileNotFoundError(f"XML file not found: {xml_path}")
 
-    root = ElementTree.parse(xml_path).getroot()
-    floor = mappa_floor_from_xml(root, ITEMS_BY_NAME)
+    return render_compiled_floor(FLOOR_CACHE.compile_file(xml_path), flags)
+
+def generate_map_from_xml(xml_data: bytes, flags=[], dtef_zip: Optional[bytes] = None):
+    return render_compiled_floor(FLOOR_CACHE.compile(xml_data), flags, dtef_zip)
+
+def render_compiled_floor(compiled: CompiledFloor, flags=[], dtef_zip: Optional[bytes] = None):
     options = Options(" ".join(flags))
-    tileset_id = int(root.find('FloorLayout').get('tileset', 0))
-
-    with DtefProvider(None, tileset_id) as dtef:
-        base_tiles = dungeon_data_files()
-        ExplorersDtefImporter(*base_tiles).do_import(
-            dtef,
-            os.path.join(dtef, "tileset.dtef.xml"),
-            os.path.join(dtef, "tileset_0.png"),
-            os.path.join(dtef, "tileset_1.png"),
-            os.path.join(dtef, "tileset_2.png")
-        )
-        return generate_floor(options, floor, base_tiles).getvalue()
+
+    def render():
+        tileset = load_tileset(dtef_zip, compiled.tileset_id)
+        return generate_floor(options, compiled.floor, tileset, compiled.sampler).getvalue()
+
+    # Renders with a random seed are never requested twice.
+    if not options.fixed_seed:
+        return render()
+    key = render_cache_key(compiled.xml_hash, tileset_cache_key(dtef_zip, compiled.tileset_id), options)
+    return RENDER_CACHE.get_or_render(key, render)
+
+def generate_map_layers(xml_path, flags=[]):
+    """All layers of the map (see FLOOR_LAYERS) as separate images, from one generated floor."""
+    compiled = FLOOR_CACHE.compile_file(xml_path)
+    options = Options(" ".join(flags))
+    tileset = load_tileset(None, compiled.tileset_id)
+    layers = generate_floor_layers(options, compiled.floor, tileset, compiled.sampler)
+    return {layer: data.getvalue() for layer, data in layers.items()}
+
+def draw_map_layers(xml_path, flags=[]):
+    """Like generate_map_layers, but returns the cairo surfaces, eg. to composite them with composite_layers."""
+    compiled = FLOOR_CACHE.compile_file(xml_path)
+    return draw_floor_layers(Options(" ".join(flags)), compiled.floor, load_tileset(None, compiled.tileset_id),
+                             compiled.sampler)
+
+def output_extension(flags=[]) -> str:
+    """File extension for maps rendered with these flags."""
+    return ENCODING_EXTENSIONS[Options(" ".join(flags)).encoding]
+
+# --- Encoding benchmark ---
+def bench_encodings(xml_path, seeds: range, flags=[]) -> dict:
+    """
+    Renders the floor once per seed and encodes every render with all encodings.
+    Returns the average encoding time (ms) and size (bytes) per encoding.
+    """
+    compiled = FLOOR_CACHE.compile_file(xml_path)
+    tileset = load_tileset(None, compiled.tileset_id)
+    totals = {encoding: [0.0, 0] for encoding in ENCODINGS}
+    for seed in seeds:
+        options = Options(" ".join(list(flags) + [f"+seed:{seed}"]))
+        surface = draw_floor(options, compiled.floor, tileset, compiled.sampler)
+        for encoding in ENCODINGS:
+            start = time.perf_counter()
+            size = len(encode_surface(surface, encoding).getbuffer())
+            totals[encoding][0] += time.perf_counter() - start
+            totals[encoding][1] += size
+    return {
+        encoding: {"ms": seconds * 1000 / len(seeds), "bytes": size / len(seeds)}
+        for encoding, (seconds, size) in totals.items()
+    }
+
+# --- Batch rendering ---
+def parse_seed_range(text: str) -> range:
+    """Parses "<seed>" or "<first>-<last>" (inclusive)."""
+    if "-" in text:
+        first, last = text.split("-", 1)
+        return range(int(first), int(last) + 1)
+    return range(int(text), int(text) + 1)
+
+def collect_xml_files(pattern: str) -> List[str]:
+    """All XML files in the directory `pattern`, or all files matching the glob `pattern`."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.xml")
+    return sorted(glob.glob(pattern))
+
+def _batch_render_one(job: Tuple[str, int, str, str]) -> dict:
+    xml_path, seed, flags, out_path = job
+    entry = {"xml": xml_path, "seed": seed, "flags": flags, "file": os.path.basename(out_path), "error": None}
+    try:
+        png_data = generate_map(xml_path, flags.split() + [f"+seed:{seed}"])
+        with open(out_path, "wb") as f:
+            f.write(png_data)
+    except Exception as e:
+        entry["file"] = None
+        entry["error"] = f"{type(e).__name__}: {e}"
+    return entry
+
+def batch_render(pattern: str, seeds: range, flag_sets: List[str], out_dir: str, jobs: Optional[int] = None) -> dict:
+    """
+    Renders every floor XML matched by `pattern` with every seed and every flag set into `out_dir`.
+    The renders are spread over `jobs` processes (default: one per CPU), each loading the assets only once.
+    Writes and returns a manifest listing every render and its output file or error.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    batch = []
+    for xml_path in collect_xml_files(pattern):
+        stem = os.path.splitext(os.path.basename(xml_path))[0]
+        for flags_idx, flags in enumerate(flag_sets):
+            for seed in seeds:
+                ext = output_extension(flags.split())
+                batch.append((xml_path, seed, flags, os.path.join(out_dir, f"{stem}_{flags_idx}_{seed}.{ext}")))
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    start = time.perf_counter()
+    if jobs <= 1:
+        entries = [_batch_render_one(job) for job in batch]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            entries = list(executor.map(_batch_render_one, batch, chunksize=max(1, len(batch) // (jobs * 8))))
+    seconds = time.perf_counter() - start
+
+    manifest = {
+        "renders": entries,
+        "failed": sum(1 for x in entries if x["error"] is not None),
+        "seconds": seconds,
+        "maps_per_second": len(entries) / seconds if seconds > 0 else 0.0,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+# --- Seed sweeps ---
+def sweep_map(xml_path, seeds: range, patches: bool = True) -> List[LayoutSummary]:
+    """Generates only the layouts (no drawing) of the floor for all seeds."""
+    compiled = FLOOR_CACHE.compile_file(xml_path)
+    return sweep_seeds(compiled.floor, seeds, patches, compiled.sampler)
+
+def check_dma_parity(xml_path, seeds: range) -> List[int]:
+    """Renders the terrain of the floor for all seeds with both autotilers. Returns the seeds that differ."""
+    compiled = FLOOR_CACHE.compile_file(xml_path)
+    tileset = load_tileset(None, compiled.tileset_id)
+    mismatches = []
+    for seed in seeds:
+        actions = generate_layout(compiled.floor, seed, True, compiled.sampler)
+        if actions is None:
+            continue
+        drawer = FixedRoomDrawer(Options(""), FixedFloor.new(SIZE_Y, SIZE_X, actions), *tileset)
+        if not dma_mappings_match(tileset[0], drawer.terrain_grid()):
+            mismatches.append(seed)
+    return mismatches
+
+# --- CLI entrypoint ---
+def parity_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="map_maker.py --check-parity",
+                                     description="Check the NumPy autotiler against DmaDrawer.")
+    parser.add_argument("xml", help="Floor XML.")
+    parser.add_argument("--seeds", type=parse_seed_range, default=range(0, 100),
+                        help="Seed or inclusive seed range (default: 0-99).")
+    args = parser.parse_args(argv)
+
+    mismatches = check_dma_parity(args.xml, args.seeds)
+    if mismatches:
+        print(f"Autotiling differs from DmaDrawer for seeds: {', '.join(str(x) for x in mismatches)}")
+        sys.exit(1)
+    print(f"Autotiling matches DmaDrawer for all {len(args.seeds)} seeds.")
+
+def sweep_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="map_maker.py --sweep",
+                                     description="Generate the layout of a floor for many seeds, without drawing.")
+    parser.add_argument("xml", help="Floor XML.")
+    parser.add_argument("--seeds", type=parse_seed_range, default=range(0, 1000),
+                        help="Seed or inclusive seed range (default: 0-999).")
+    parser.add_argument("--nopatches", action="store_true", help="Generate as if no patches are applied.")
+    parser.add_argument("--json", default=None, help="Also write all layouts to this JSON file.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    layouts = sweep_map(args.xml, args.seeds, not args.nopatches)
+    seconds = time.perf_counter() - start
+
+    generated = [x for x in layouts if not x.failed]
+    print(f"Seeds: {len(layouts)} in {seconds:.2f}s ({len(layouts) / seconds if seconds > 0 else 0.0:.0f} seeds/second)")
+    print(f"Failed: {len(layouts) - len(generated)}")
+    if generated:
+        rooms = [x.rooms for x in generated]
+        print(f"Rooms: min {min(rooms)}, avg {sum(rooms) / len(rooms):.2f}, max {max(rooms)}")
+        print(f"Kecleon shops: {sum(1 for x in generated if x.kecleon_shop)}")
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump([dict(x._asdict(), terrain=list(x.terrain)) for x in layouts], f)
+
+def bench_encoding_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="map_maker.py --bench-encoding",
+                                     description="Compare the speed and output size of the map encodings.")
+    parser.add_argument("xml", help="Floor XML.")
+    parser.add_argument("--seeds", type=parse_seed_range, default=range(0, 10),
+                        help="Seed or inclusive seed range (default: 0-9).")
+    parser.add_argument("--flags", default="", help="Flags to render with, eg. \"+onlyfloor\".")
+    args = parser.parse_args(argv)
+
+    results = bench_encodings(args.xml, args.seeds, args.flags.split())
+    for encoding, result in results.items():
+        print(f"{encoding:>8}: {result['ms']:8.1f} ms {result['bytes'] / 1024:9.1f} KiB")
+
+def batch_main(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="map_maker.py --batch", description="Render many floors and seeds at once.")
+    parser.add_argument("pattern", help="Directory containing floor XMLs, or a glob pattern matching them.")
+    parser.add_argument("--seeds", type=parse_seed_range, default=range(0, 1),
+                        help="Seed or inclusive seed range, eg. 0-999 (default: 0).")
+    parser.add_argument("--flags", action="append", default=None,
+                        help="Set of flags to render with, eg. \"+onlyfloor +nokecleon\". Can be repeated.")
+    parser.add_argument("--out", default=os.path.join("assets", "batch"), help="Output directory.")
+    parser.add_argument("--jobs", type=int, default=None, help="Number of processes (default: number of CPUs).")
+    args = parser.parse_args(argv)
+
+    manifest = batch_render(args.pattern, args.seeds, args.flags or [""], args.out, args.jobs)
+    print(f"Rendered {len(manifest['renders'])} maps ({manifest['failed']} failed) in {manifest['seconds']:.1f}s: "
+          f"{manifest['maps_per_second']:.2f} maps/second")
 
 # --- CLI entrypoint ---
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        batch_main(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--sweep":
+        sweep_main(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--check-parity":
+        parity_main(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-encoding":
+        bench_encoding_main(sys.argv[2:])
+        sys.exit(0)
     if len(sys.argv) < 2:
         print("Usage: python dungeon_gen.py <floor.xml> [+flags...]")
+        print("       python dungeon_gen.py --layers <floor.xml> [+flags...]")
+        print("       python dungeon_gen.py --batch <dir or glob> [--seeds 0-99] [--flags \"+flags...\"] [--out dir]")
+        print("       python dungeon_gen.py --sweep <floor.xml> [--seeds 0-999] [--nopatches] [--json out.json]")
+        print("       python dungeon_gen.py --check-parity <floor.xml> [--seeds 0-99]")
+        print("       python dungeon_gen.py --bench-encoding <floor.xml> [--seeds 0-9] [--flags \"+flags...\"]")
         sys.exit(1)
 
+    if sys.argv[1] == "--layers":
+        xml_file, flags = sys.argv[2], sys.argv[3:]
+        try:
+            for layer, data in generate_map_layers(xml_file, flags).items():
+                out_file = os.path.join("assets", f"generated_map_{layer}.{output_extension(flags)}")
+                with open(out_file, "wb") as f:
+                    f.write(data)
+                print(f"Layer generated: {out_file}")
+        except Exception as e:
+            print(f"Error: {e}")
+        sys.exit(0)
+
     xml_file, flags = sys.argv[1], sys.argv[2:]
-    out_file = os.path.join("assets", "generated_map.png")
+    out_file = os.path.join("assets", f"generated_map.{output_extension(flags)}")
 
     try:
         png_data = generate_map(xml_file, flags)
@@ -8,7 +8,9 @@ import threading
 sys.path.append(os.path.dirname(__file__))
 
 try:
-    from map_maker import generate_map
+    from map_maker import draw_map_layers
+    from specific.eos_dungeons import is_extraction_complete, Options, UserError, composite_layers, visible_layers, \
+        encode_surface, SpriteProvider, RENDER_CACHE
 except ImportError as e:
     print(f"Error importing generate_map_from_xml: {e}")
     print("Make sure you're running this from the project root directory")
@@ -28,6 +30,8 @@ class MapMakerGUI:
 
         self.options = {}
         self.generated_image_data = None
+        # Layers of the last generated map. Toggling what is shown only recomposites them.
+        self.generated_layers = None
 
         self.setup_ui()
 
@@ -135,6 +139,10 @@ class MapMakerGUI:
             variable=self.options['nopatches']
         ).grid(row=0, column=2, sticky=tk.W)
 
+        for key in ('onlyfloor', 'nostairs', 'nomonsters', 'noflooritems', 'notraps', 'nokecleon', 'showgrid',
+                    'burieditems'):
+            self.options[key].trace_add('write', self.on_visibility_changed)
+
         seed_frame = ttk.Frame(advanced_frame)
         seed_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0))
 
@@ -340,43 +348,73 @@ class MapMakerGUI:
         if filename:
             self.selected_rom.set(filename)
             self.rom_label.config(text=os.path.basename(filename), foreground="black")
+            self.status_label.config(text="Checking extracted files...")
 
-            # Check if dtef files already exist
-            dtef_dir = os.path.join(os.path.dirname(__file__), "assets", "dungeon_tiles", "dtef")
-            if os.path.isdir(dtef_dir) and any(os.path.isdir(os.path.join(dtef_dir, name)) for name in os.listdir(dtef_dir)):
-                self.status_label.config(text="ROM already processed (dtef files found)")
-                messagebox.showinfo("ROM Processing Skipped", "ROM processing skipped: dtef files already exist.")
-                return
+            # Check if this ROM was already fully extracted. Hashing the ROM takes a moment, so it is done in
+            # the background like the extraction.
+            assets_dir = os.path.join(os.path.dirname(__file__), "assets", "dungeon_tiles")
+
+            def check_extraction():
+                complete = is_extraction_complete(filename, assets_dir)
+                self.root.after(0, self.rom_checked, filename, complete)
+
+            threading.Thread(target=check_extraction, daemon=True).start()
+
+    def rom_checked(self, filename, complete):
+        # Another ROM was selected in the meantime
+        if self.selected_rom.get() != filename:
+            return
+        if complete:
+            self.status_label.config(text="ROM already processed (extracted files are up to date)")
+            messagebox.showinfo("ROM Processing Skipped", "ROM processing skipped: files already extracted.")
+            return
+        self.process_rom()
+
+    def process_rom(self):
+        self.status_label.config(text="Processing ROM... please wait")
+
+        # Loading popup
+        loading_win = tk.Toplevel(self.root)
+        loading_win.title("Loading")
+        loading_win.geometry("300x100")
+        loading_win.transient(self.root)
+        loading_win.grab_set()
 
-            self.status_label.config(text="Processing ROM... please wait")
-
-            # Loading popup
-            loading_win = tk.Toplevel(self.root)
-            loading_win.title("Loading")
-            loading_win.geometry("300x100")
-            loading_win.transient(self.root)
-            loading_win.grab_set()
-
-            ttk.Label(loading_win, text="Processing ROM, please wait...").pack(pady=10)
-            progress = ttk.Progressbar(loading_win, mode="indeterminate")
-            progress.pack(fill="x", padx=20, pady=10)
-            progress.start()
-
-            def run_rom_setup():
-                try:
-                    subprocess.run(
-                        [sys.executable, "specific/eos_dungeons.py", self.selected_rom.get()],
-                        check=True
-                    )
-                    self.status_label.config(text="ROM processed successfully!")
-                except subprocess.CalledProcessError as e:
-                    messagebox.showerror("Error", f"ROM processing failed:\n{e}")
-                    self.status_label.config(text="ROM processing failed")
-                finally:
-                    progress.stop()
-                    loading_win.destroy()
-
-            threading.Thread(target=run_rom_setup, daemon=True).start()
+        loading_label = ttk.Label(loading_win, text="Processing ROM, please wait...")
+        loading_label.pack(pady=10)
+        progress = ttk.Progressbar(loading_win, mode="determinate", maximum=1)
+        progress.pack(fill="x", padx=20, pady=10)
+
+        def show_progress(done, total):
+            progress.config(maximum=total, value=done)
+            loading_label.config(text=f"Processing ROM, please wait... ({done}/{total} steps)")
+
+        def run_rom_setup():
+            try:
+                # Unmap the currently extracted files, so the extractor can replace them
+                SpriteProvider.shared().reload()
+                # The extractor reports "PROGRESS <done>/<total>" after every tileset and sprite sheet step
+                proc = subprocess.Popen(
+                    [sys.executable, "specific/eos_dungeons.py", self.selected_rom.get()],
+                    stdout=subprocess.PIPE, text=True
+                )
+                for line in proc.stdout:
+                    if line.startswith("PROGRESS "):
+                        done, total = line[9:].strip().split("/")
+                        self.root.after(0, show_progress, int(done), int(total))
+                if proc.wait() != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, proc.args)
+                # Drop the sprites, tilesets and renders of the previously extracted ROM
+                SpriteProvider.shared().reload()
+                RENDER_CACHE.clear()
+                self.status_label.config(text="ROM processed successfully!")
+            except subprocess.CalledProcessError as e:
+                messagebox.showerror("Error", f"ROM processing failed:\n{e}")
+                self.status_label.config(text="ROM processing failed")
+            finally:
+                loading_win.destroy()
+
+        threading.Thread(target=run_rom_setup, daemon=True).start()
 
     # ------------------- Other Existing Functions -------------------
     def on_only_floor_changed(self, *args):
@@ -430,16 +468,8 @@ class MapMakerGUI:
         self.root.update()
 
         try:
-            import xml.etree.ElementTree as ET
-            with open(self.selected_file.get(), 'rb') as f:
-                xml_tree = ET.parse(f)
-                root = xml_tree.getroot()
-
-            floor_layout = root.find('FloorLayout')
-            if floor_layout is None:
-                raise ValueError("XML file does not contain a 'FloorLayout' element.")
-
-            png_data = generate_map(self.selected_file.get(), options)
+            self.generated_layers = draw_map_layers(self.selected_file.get(), options)
+            png_data = self.composite_generated_layers(options)
             self.generated_image_data = png_data
             self.show_preview(png_data)
             self.status_label.config(text="Map generated successfully! Preview shown below.")
@@ -464,6 +494,24 @@ class MapMakerGUI:
             self.progress.stop()
             self.generate_btn.config(state='normal')
 
+    def composite_generated_layers(self, options):
+        visible = visible_layers(Options(" ".join(options)))
+        return encode_surface(composite_layers(self.generated_layers, visible)).getvalue()
+
+    def on_visibility_changed(self, *args):
+        if self.generated_layers is None:
+            return
+        options = self.get_options_list()
+        if options is None:
+            return
+        try:
+            png_data = self.composite_generated_layers(options)
+        except UserError as e:
+            self.status_label.config(text=f"{e.title}: {e.message}")
+            return
+        self.generated_image_data = png_data
+        self.show_preview(png_data)
+
     def show_preview(self, png_data):
         try:
             import tempfile
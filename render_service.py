@@ -0,0 +1,190 @@
+"""
+Local HTTP render service.
+Keeps a pool of worker processes with all rendering assets loaded, so maps don't pay for the startup.
+Usage: python render_service.py [--port 8888] [--processes N] [--queue 32] [--timeout 30]
+                                [--cache-mb 64] [--cache-dir DIR] [--cache-disk-mb 512]
+
+POST /render
+  The body is the floor XML. To also send a DTEF ZIP, use multipart/form-data with the XML as the file
+  field "floor" and the ZIP as the file field "dtef".
+  Flags are given in the "flags" query argument, separated by spaces or commas. The leading "+" is optional
+  (a literal "+" must be URL-encoded as %2B), eg. /render?flags=onlyfloor,seed:12345
+  Returns the rendered map as PNG, or in the format set with the "encoding:" flag.
+  Renders with a fixed seed are cached, so repeated requests for the same floor, tileset and flags are answered
+  without rendering again.
+GET /status
+  Returns the number of renders in progress, the service limits and the render cache hit rate as JSON.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List
+
+import tornado.ioloop
+import tornado.web
+
+logger = logging.getLogger(__name__)
+
+
+# --- Worker side ---
+def _warm_up(cache_bytes: int, cache_dir: Optional[str], cache_disk_bytes: int):
+    # Imports all rendering modules and loads the assets once per worker process.
+    from specific.eos_dungeons import SpriteProvider, RENDER_CACHE, TILESET_CACHE
+    provider = SpriteProvider.shared()
+    provider.dungeon_bin, provider.item_p, provider.monster_md, provider.monster_bin
+    RENDER_CACHE.max_bytes = cache_bytes
+    RENDER_CACHE.cache_dir = cache_dir
+    RENDER_CACHE.max_disk_bytes = cache_disk_bytes
+    # Uploaded DTEF tilesets are kept next to the renders, so they are only imported once
+    TILESET_CACHE.cache_dir = os.path.join(cache_dir, 'tilesets') if cache_dir is not None else None
+
+
+def _render(xml_data: bytes, flags: List[str], dtef_zip: Optional[bytes]):
+    # Errors caused by the request are returned as messages (answered with 400), everything else is raised.
+    from xml.etree.ElementTree import ParseError
+    from skytemple_files.common.xml_util import XmlValidateError
+    from specific.eos_dungeons import UserError, Options, ENCODING_MEDIA_TYPES, RENDER_CACHE
+    from map_maker import generate_map_from_xml
+    try:
+        media_type = ENCODING_MEDIA_TYPES[Options(" ".join(flags)).encoding]
+        hits = RENDER_CACHE.hits
+        data = generate_map_from_xml(xml_data, flags, dtef_zip)
+        return True, (data, media_type, RENDER_CACHE.hits > hits)
+    except UserError as e:
+        return False, f"{e.title}: {e.message}"
+    except (ParseError, XmlValidateError) as e:
+        return False, f"Invalid XML: {e}"
+    except ValueError as e:
+        # Floors and tilesets with invalid values
+        return False, f"Invalid input: {e}"
+
+
+# --- Service side ---
+class RenderService:
+    def __init__(
+            self, processes: int, max_queue: int, timeout: float,
+            cache_bytes: int = 64 * 1024 * 1024, cache_dir: Optional[str] = None,
+            cache_disk_bytes: int = 512 * 1024 * 1024
+    ):
+        self.processes = processes
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        # Renders answered from the workers' render caches
+        self.cache_hits = 0
+        self.renders = 0
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes, initializer=_warm_up, initargs=(cache_bytes, cache_dir, cache_disk_bytes)
+        )
+
+    @property
+    def capacity(self) -> int:
+        return self.processes + self.max_queue
+
+    def render_finished(self):
+        self.pending -= 1
+
+
+class RenderHandler(tornado.web.RequestHandler):
+    def initialize(self, service: RenderService):
+        self.service = service
+
+    def write_error(self, status_code: int, **kwargs):
+        # Errors raised below are answered like failed renders, with a JSON body instead of an HTML page
+        self.finish({'error': self._reason})
+
+    async def post(self):
+        xml_data = self.request.body
+        dtef_zip = None
+        if 'floor' in self.request.files:
+            xml_data = self.request.files['floor'][0].body
+            if 'dtef' in self.request.files:
+                dtef_zip = self.request.files['dtef'][0].body
+        if not xml_data:
+            raise tornado.web.HTTPError(400, reason="No floor XML given.")
+        flags = [
+            x if x.startswith('+') else '+' + x
+            for x in re.split(r'[\s,]+', self.get_query_argument('flags', '')) if x != ''
+        ]
+
+        service = self.service
+        if service.pending >= service.capacity:
+            raise tornado.web.HTTPError(503, reason="Too many queued renders.")
+        concurrent_future = service.executor.submit(_render, xml_data, flags, dtef_zip)
+        # A render counts as pending until its worker is done with it, even if the client already got a timeout.
+        service.pending += 1
+        io_loop = tornado.ioloop.IOLoop.current()
+        concurrent_future.add_done_callback(lambda _: io_loop.add_callback(service.render_finished))
+        try:
+            ok, result = await asyncio.wait_for(asyncio.wrap_future(concurrent_future), service.timeout)
+        except asyncio.TimeoutError:
+            raise tornado.web.HTTPError(504, reason="Rendering timed out.")
+
+        if not ok:
+            self.set_status(400)
+            self.write({'error': result})
+            return
+        data, media_type, cache_hit = result
+        service.renders += 1
+        service.cache_hits += cache_hit
+        self.set_header('Content-Type', media_type)
+        self.write(data)
+
+
+class StatusHandler(tornado.web.RequestHandler):
+    def initialize(self, service: RenderService):
+        self.service = service
+
+    def get(self):
+        self.write({
+            'pending': self.service.pending,
+            'processes': self.service.processes,
+            'max_queue': self.service.max_queue,
+            'timeout': self.service.timeout,
+            'renders': self.service.renders,
+            'cache_hits': self.service.cache_hits,
+            'cache_hit_rate': self.service.cache_hits / self.service.renders if self.service.renders > 0 else 0.0,
+        })
+
+
+def make_app(service: RenderService) -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/render", RenderHandler, dict(service=service)),
+        (r"/status", StatusHandler, dict(service=service)),
+    ])
+
+
+# --- CLI entrypoint ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP dungeon render service.")
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="Number of render worker processes (default: number of CPUs).")
+    parser.add_argument('--queue', type=int, default=32,
+                        help="Number of renders that may wait for a free worker before requests are rejected.")
+    parser.add_argument('--timeout', type=float, default=30,
+                        help="Seconds after which a render request is answered with an error.")
+    parser.add_argument('--cache-mb', type=int, default=64,
+                        help="Memory budget of the render cache of each worker, in MiB (default: 64).")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Directory to also keep rendered maps and imported tilesets in, shared by all workers "
+                             "(default: none).")
+    parser.add_argument('--cache-disk-mb', type=int, default=512,
+                        help="Disk budget of the render cache directory, in MiB (default: 512).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    service = RenderService(
+        args.processes, args.queue, args.timeout,
+        args.cache_mb * 1024 * 1024, args.cache_dir, args.cache_disk_mb * 1024 * 1024
+    )
+    # Start all workers now, instead of on the first requests
+    for f in [service.executor.submit(int) for _ in range(args.processes)]:
+        f.result()
+    make_app(service).listen(args.port)
+    logger.info(f"Render service listening on port {args.port} with {args.processes} workers.")
+    tornado.ioloop.IOLoop.current().start()
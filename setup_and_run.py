@@ -12,7 +12,8 @@ required_packages = [
     "skytemple-files==1.8.3",
     "skytemple-rust==1.8.2",
     "skytemple-dtef==1.6.1",
-    "pycairo"
+    "pycairo",
+    "numpy"
 ]
 
 # --- Helper function to check if a package is installed ---
@@ -24,24 +24,43 @@ The following strings can be contained in the message and change how the floor i
   - `+burieditems`: Shows buried items
   - `+nopatches`: Renders the floor as if the "UnusedDungeonChancePatch" patch is not applied
   - `+seed:<seed>`: Sets the seed for the random number generator.
+  - `+encoding:<encoding>`: Sets the output format:
+      - `default`: PNG, as encoded by cairo
+      - `fast`: PNG with the lowest zlib compression, fastest to encode but larger
+      - `small`: Indexed-color PNG with maximum compression, smallest but slowest to encode
+      - `webp`: Lossless WebP
+      - `raw`: Uncompressed RGBA pixels, row by row (the full map is always 1584x1008)
+  - `+showgrid`: Draws a grid over the floor
+      - `+gridsize:<pixels>`: Sets the size of the grid cells (default: 24, one tile)
+      - `+gridcolor:<RRGGBB[AA]>`: Sets the color of the grid lines (default: 00000080)
 
 Example: "+onlyfloor +nokecleon +seed:12345"
 """
+import argparse
+import hashlib
+import json
 import logging
+import mmap
 import os
 import random
 import shutil
+import struct
+import threading
 import traceback
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from contextlib import contextmanager
 from io import BytesIO
-from tempfile import TemporaryDirectory
-from typing import Optional, ContextManager, Tuple, List, Union
+from typing import Optional, Tuple, List, Union, Callable, Dict, NamedTuple, Iterable, Generic, TypeVar, Hashable
 from xml.etree import ElementTree
 from xml.etree.ElementTree import ParseError
-from zipfile import ZipFile
+from zipfile import ZipFile, BadZipFile
 import sys
 import cairo
-from PIL import Image
+import numpy as np
+from PIL import Image, features, UnidentifiedImageError
 from ndspy.rom import NintendoDSRom
 
 from skytemple_files.common.impl_cfg import change_implementation_type, ImplementationType
@@ -64,7 +83,7 @@ from skytemple_files.dungeon_data.fixed_bin.model import DirectRule, FixedFloor,
     EntityRule
 from skytemple_files.dungeon_data.mappa_bin.protocol import MappaFloorProtocol, GUARANTEED, POKE_ID, MappaTrapType
 from skytemple_files.graphics.dma.dma_drawer import DmaDrawer
-from skytemple_files.graphics.dma.protocol import DmaType
+from skytemple_files.graphics.dma.protocol import DmaType, DmaNeighbor
 from skytemple_files.graphics.dpc import DPC_TILING_DIM
 from skytemple_files.graphics.dpci import DPCI_TILE_DIM
 from skytemple_files.graphics.img_itm.model import ImgItm
@@ -108,37 +127,93 @@ def asset_path() -> str:
 
 
 class DtefProvider:
-    def __init__(self, potential_zip_file_bytes: Optional[bytes], tileset_id: int):
-        self.zip_file = None
+    """Path of the extracted DTEF files of a vanilla tileset. DTEF ZIPs are read by `ZipDtefImporter` instead."""
+    def __init__(self, tileset_id: int):
         self.tileset_id = tileset_id
-        self.zip_tmp_ctx: Optional[ContextManager] = None
-        if potential_zip_file_bytes is not None:
-            # Read potential_zip_file_bytes as a zip file
-            self.zip_file = ZipFile(BytesIO(potential_zip_file_bytes))
 
     def __enter__(self):
-        path: str
-
-        if self.zip_file is not None:
-            self.zip_tmp_ctx = TemporaryDirectory()
-            path = self.zip_tmp_ctx.__enter__()
-            for file in self.zip_file.namelist():
-                if "\\" in file or "/" in file:
-                    raise UserError("Invalid ZIP file", "The DTEF ZIP file may not contain sub-directories.")
-                self.zip_file.extract(file, path)
-        else:
-            path = os.path.join( "assets/dungeon_tiles", "dtef", str(self.tileset_id))
-            if not os.path.exists(path):
-                raise UserError("Invalid Tileset", f"The tileset with ID {self.tileset_id} does not exist.")
-
+        path = os.path.join( "assets/dungeon_tiles", "dtef", str(self.tileset_id))
+        if not os.path.exists(path):
+            raise UserError("Invalid Tileset", f"The tileset with ID {self.tileset_id} does not exist.")
         return path
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.zip_tmp_ctx is not None:
-            self.zip_tmp_ctx.__exit__(exc_type, exc_val, exc_tb)
+        pass
+
 
+# Limits for the members of uploaded DTEF ZIPs (uncompressed)
+DTEF_MAX_MEMBER_BYTES = 8 * 1024 * 1024
+DTEF_MAX_TOTAL_BYTES = 32 * 1024 * 1024
 
-def dungeon_data_files() -> Tuple[Dma, Dpc, Dpci, Dpl, Dpla]:
+
+def validate_dtef_zip(zip_file: ZipFile) -> Dict[str, int]:
+    """
+    Checks the member list of a DTEF ZIP, without extracting anything. Returns the uncompressed size of every member.
+    """
+    members = {}
+    for info in zip_file.infolist():
+        if "\\" in info.filename or "/" in info.filename:
+            raise UserError("Invalid ZIP file", "The DTEF ZIP file may not contain sub-directories.")
+        if info.file_size > DTEF_MAX_MEMBER_BYTES:
+            raise UserError("Invalid ZIP file", f"The file {info.filename} in the DTEF ZIP file is too large.")
+        members[info.filename] = info.file_size
+    if sum(members.values()) > DTEF_MAX_TOTAL_BYTES:
+        raise UserError("Invalid ZIP file", "The DTEF ZIP file is too large.")
+    for required in (DTEF_XML_NAME, DTEF_VAR0_FN, DTEF_VAR1_FN, DTEF_VAR2_FN):
+        if required not in members:
+            raise UserError("Invalid ZIP file", f"The DTEF ZIP file does not contain {required}.")
+    return members
+
+
+class ZipDtefImporter(ExplorersDtefImporter):
+    """ExplorersDtefImporter that reads the DTEF files straight from an in-memory ZIP instead of a directory."""
+    def import_zip(self, zip_bytes: bytes):
+        try:
+            zip_file = ZipFile(BytesIO(zip_bytes))
+        except BadZipFile:
+            raise UserError("Invalid ZIP file", "The DTEF file is not a valid ZIP file.")
+        self._zip_members = validate_dtef_zip(zip_file)
+        self._zip_file = zip_file
+        try:
+            self.do_import(
+                "", BytesIO(zip_file.read(DTEF_XML_NAME)), DTEF_VAR0_FN, DTEF_VAR1_FN, DTEF_VAR2_FN
+            )
+        except (BadZipFile, zlib.error, UnidentifiedImageError) as e:
+            # Corrupted members
+            raise UserError("Invalid ZIP file", f"The DTEF ZIP file could not be read: {e}")
+        except ValueError as e:
+            # Invalid tileset images or XML
+            raise UserError("Invalid ZIP file", f"The DTEF ZIP file could not be imported: {e}")
+
+    def _assert_file_exists(self, fn):
+        # The XML is passed in as a file object, all other files by name
+        if isinstance(fn, str) and os.path.basename(fn) not in self._zip_members:
+            raise ValueError(f"A required DTEF file is missing: {fn}. Please verify the DTEF package.")
+
+    def _open_tileset(self, fn):
+        # Same checks as ExplorersDtefImporter._open_tileset, but with the image read from the ZIP
+        self._assert_file_exists(fn)
+        basename = os.path.basename(fn)
+        pil = self._tileset_file_map[basename] = Image.open(BytesIO(self._zip_file.read(basename)))
+        self._tileset_chunk_map[basename] = {}
+        if pil.mode != 'P':
+            raise ValueError(f'Can not import image "{basename}" as dungeon tileset: '
+                             f'Must be indexed image (=using a palette)')
+        if pil.palette.mode != 'RGB':
+            raise ValueError(f'Can not import image "{basename}" as dungeon tileset: '
+                             f'Palette must contain 256 RGB colors.')
+        if self._palette is None:
+            self._palette = bytes(pil.palette.palette)
+        if pil.palette.palette != self._palette:
+            raise ValueError(f'Can not import images as dungeon tilesets: '
+                             f'The palettes of the images do not match. First image read that didn\'t match: '
+                             f'"{basename}"')
+
+
+TilesetData = Tuple[Dma, Dpc, Dpci, Dpl, Dpla]
+
+
+def dungeon_data_files() -> TilesetData:
     with open(os.path.join(asset_path(), "base.dma"), "rb") as f:
         dma = FileType.DBIN_SIR0_AT4PX_DMA.deserialize(f.read())
     with open(os.path.join(asset_path(), "base.dpc"), "rb") as f:
@@ -153,6 +228,254 @@ def dungeon_data_files() -> Tuple[Dma, Dpc, Dpci, Dpl, Dpla]:
     return dma, dpc, dpci, dpl, dpla
 
 
+TILESET_BUNDLE_MAGIC = b'STSB'
+_TILESET_BUNDLE_HEADER = struct.Struct('<4s5I')
+
+
+TILESET_BUNDLE_DIR = 'bundles'
+
+
+def pack_tileset_bundle(dma: bytes, dpc: bytes, dpci: bytes, dpl: bytes, dpla: bytes) -> bytes:
+    """
+    Packs the serialized files of a tileset (in the same formats as the base.* files) into a bundle:
+    a small header with the sizes of the five files, followed by them.
+    """
+    parts = [dma, dpc, dpci, dpl, dpla]
+    return _TILESET_BUNDLE_HEADER.pack(TILESET_BUNDLE_MAGIC, *(len(x) for x in parts)) + b''.join(parts)
+
+
+def serialize_tileset(tileset: TilesetData) -> bytes:
+    dma, dpc, dpci, dpl, dpla = tileset
+    return pack_tileset_bundle(
+        FileType.DBIN_SIR0_AT4PX_DMA.serialize(dma),
+        FileType.DBIN_AT4PX_DPC.serialize(dpc),
+        FileType.DBIN_AT4PX_DPCI.serialize(dpci),
+        FileType.DPL.serialize(dpl),
+        FileType.DBIN_SIR0_DPLA.serialize(dpla),
+    )
+
+
+def deserialize_tileset(data: bytes) -> TilesetData:
+    magic, *sizes = _TILESET_BUNDLE_HEADER.unpack_from(data)
+    if magic != TILESET_BUNDLE_MAGIC:
+        raise ValueError("Not a tileset bundle.")
+    parts = []
+    offset = _TILESET_BUNDLE_HEADER.size
+    for size in sizes:
+        parts.append(data[offset:offset + size])
+        offset += size
+    return (
+        FileType.DBIN_SIR0_AT4PX_DMA.deserialize(parts[0]),
+        FileType.DBIN_AT4PX_DPC.deserialize(parts[1]),
+        FileType.DBIN_AT4PX_DPCI.deserialize(parts[2]),
+        FileType.DPL.deserialize(parts[3]),
+        FileType.DBIN_SIR0_DPLA.deserialize(parts[4]),
+    )
+
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LruCache(Generic[K, V]):
+    """
+    Thread-safe LRU cache with a size budget. Every entry has a size (1 unless given, so by default `max_size` is
+    the number of entries). The least recently used entries are evicted while the total size exceeds `max_size`.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[K, Tuple[V, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: K, value: V, size: int = 1) -> V:
+        """Adds the entry and returns the value. Values larger than the whole budget are not cached."""
+        if size > self.max_size:
+            return value
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def cached_by_identity(cache: LruCache, objs: tuple, build: Callable[[], V], *key: Hashable) -> V:
+    """
+    `build()`, cached in `cache` by the identity of the objects in `objs` (and `key`). The objects are cached
+    together with the result, so their ids can not be reused by other objects while the entry exists.
+    """
+    cache_key = tuple(id(x) for x in objs) + key
+    entry = cache.get(cache_key)
+    if entry is not None and all(a is b for a, b in zip(entry[0], objs)):
+        return entry[1]
+    value = build()
+    cache.put(cache_key, (objs, value))
+    return value
+
+
+def write_file_atomic(path: str, data: bytes):
+    """
+    Writes the file through a temporary file next to it, so other readers (and processes) see either the previous
+    or the complete new file, never a partial one.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Number of imported tilesets kept in memory. Data derived from a tileset (see `dma_chunk_table` and `tile_atlas`)
+# is kept for as many tilesets.
+TILESET_CACHE_ENTRIES = 16
+
+
+class TilesetCache:
+    """
+    Cache of imported tilesets, keyed by `tileset_cache_key`.
+    Entries are kept in memory (LRU, up to `max_entries`) and, if `cache_dir` is set, also persisted there
+    as tileset bundles, so they survive restarts.
+    The cached tileset objects are shared between renders and must not be modified.
+    """
+    def __init__(self, max_entries: int = TILESET_CACHE_ENTRIES, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self._entries: LruCache[str, TilesetData] = LruCache(max_entries)
+
+    def get(self, key: str, loader: Callable[[], TilesetData]) -> TilesetData:
+        tileset = self._entries.get(key)
+        if tileset is not None:
+            return tileset
+
+        tileset = self._read_from_disk(key)
+        if tileset is None:
+            tileset = loader()
+            self._write_to_disk(key, tileset)
+        return self._entries.put(key, tileset)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self._entries.hits, 'misses': self._entries.misses, 'entries': len(self._entries)}
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.tsb")
+
+    def _read_from_disk(self, key: str) -> Optional[TilesetData]:
+        if self.cache_dir is None or not os.path.exists(self._disk_path(key)):
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return deserialize_tileset(f.read())
+        except Exception:
+            logger.warning(f"Ignoring unreadable cached tileset {key}.", exc_info=True)
+            return None
+
+    def _write_to_disk(self, key: str, tileset: TilesetData):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_file_atomic(self._disk_path(key), serialize_tileset(tileset))
+
+
+TILESET_CACHE = TilesetCache()
+
+
+def tileset_cache_key(potential_zip_file_bytes: Optional[bytes], tileset_id: int) -> str:
+    """
+    DTEF ZIPs are keyed by their content, vanilla tilesets by their ID and the ROM they were extracted from,
+    so caches on disk never mix up the tilesets of different ROMs.
+    """
+    if potential_zip_file_bytes is not None:
+        return f"dtef-{hashlib.sha256(potential_zip_file_bytes).hexdigest()}"
+    return f"tileset-{extracted_rom_sha256()}-{tileset_id}"
+
+
+def import_tileset(potential_zip_file_bytes: Optional[bytes], tileset_id: int) -> TilesetData:
+    """Imports the tileset from the DTEF ZIP or the extracted DTEF files, bypassing the cache."""
+    if potential_zip_file_bytes is not None:
+        tileset = dungeon_data_files()
+        ZipDtefImporter(*tileset).import_zip(potential_zip_file_bytes)
+        return tileset
+    with DtefProvider(tileset_id) as dtef:
+        tileset = dungeon_data_files()
+        ExplorersDtefImporter(*tileset).do_import(
+            dtef,
+            os.path.join(dtef, DTEF_XML_NAME),
+            os.path.join(dtef, DTEF_VAR0_FN),
+            os.path.join(dtef, DTEF_VAR1_FN),
+            os.path.join(dtef, DTEF_VAR2_FN)
+        )
+        return tileset
+
+
+def tileset_bundle_path(tileset_id: int) -> str:
+    return os.path.join(asset_path(), TILESET_BUNDLE_DIR, f"{tileset_id}.tsb")
+
+
+def load_tileset(potential_zip_file_bytes: Optional[bytes], tileset_id: int) -> TilesetData:
+    def loader() -> TilesetData:
+        # Vanilla tilesets are precompiled into bundles by the ROM extraction, if available.
+        if potential_zip_file_bytes is None and os.path.exists(tileset_bundle_path(tileset_id)):
+            with open(tileset_bundle_path(tileset_id), 'rb') as f:
+                return deserialize_tileset(f.read())
+        return import_tileset(potential_zip_file_bytes, tileset_id)
+
+    return TILESET_CACHE.get(tileset_cache_key(potential_zip_file_bytes, tileset_id), loader)
+
+
+# Output encodings (see `encode_surface`)
+ENCODINGS = ('default', 'fast', 'small', 'webp', 'raw')
+ENCODING_EXTENSIONS = {'default': 'png', 'fast': 'png', 'small': 'png', 'webp': 'webp', 'raw': 'rgba'}
+ENCODING_MEDIA_TYPES = {
+    'default': 'image/png', 'fast': 'image/png', 'small': 'image/png', 'webp': 'image/webp',
+    'raw': 'application/octet-stream'
+}
+
+
+def parse_color(text: str) -> Tuple[float, float, float, float]:
+    """Parses a `RRGGBB` or `RRGGBBAA` hex color (optionally prefixed with #) into cairo RGBA floats."""
+    digits = text[1:] if text.startswith("#") else text
+    try:
+        if len(digits) not in (6, 8):
+            raise ValueError()
+        channels = [int(digits[i:i + 2], 16) / 255 for i in range(0, len(digits), 2)]
+    except ValueError:
+        raise UserError("Invalid Option", f"Invalid color: {text}")
+    if len(channels) == 3:
+        channels.append(1.0)
+    return channels[0], channels[1], channels[2], channels[3]
+
+
 class Options:
     def __init__(self, message: str):
         self.stairs = True
@@ -160,10 +483,15 @@ class Options:
         self.flooritems = True
         self.traps = True
         self.grid=False
+        self.grid_size = DPC_TILING_DIM * DPCI_TILE_DIM
+        self.grid_color = (0.0, 0.0, 0.0, 0.5)
+        self.encoding = 'default'
         self.kecleon = True
         self.burieditems = False
         self.patches = True
         self.seed = random.randint(0, 2 ** 32 - 1)
+        # Whether the seed was set with +seed: (renders with random seeds are not worth caching)
+        self.fixed_seed = False
 
         for part in message.split(" "):
             part = part.strip()
@@ -189,12 +517,34 @@ class Options:
             elif part == "+nopatches":
                 self.patches = False
             elif part.startswith("+seed:"):
-                self.seed = int(part[6:])
+                try:
+                    self.seed = int(part[6:])
+                except ValueError:
+                    raise UserError("Invalid Option", f"Invalid seed: {part[6:]}")
+                self.fixed_seed = True
             elif part.startswith("+showgrid"):
                 self.grid = True
+            elif part.startswith("+gridsize:"):
+                try:
+                    self.grid_size = int(part[10:])
+                except ValueError:
+                    self.grid_size = 0
+                if self.grid_size <= 0:
+                    raise UserError("Invalid Option", f"Invalid grid size: {part[10:]}")
+            elif part.startswith("+gridcolor:"):
+                self.grid_color = parse_color(part[11:])
+            elif part.startswith("+encoding:"):
+                self.encoding = part[10:]
+                if self.encoding not in ENCODINGS:
+                    raise UserError("Invalid Option", f"Unknown encoding: {self.encoding}. "
+                                                      f"Valid encodings: {', '.join(ENCODINGS)}")
             else:
                 raise UserError("Invalid Option", f"Unknown option: {part}")
 
+    def normalized(self) -> str:
+        """All settings as a canonical string. Equal for all messages that produce the same image."""
+        return json.dumps(vars(self), sort_keys=True)
+
 
 
 
@@ -236,23 +586,121 @@ TRAP_PALETTE_MAP = {
 }
 TRP_FILENAME = 'traps.trp.img'
 ITM_FILENAME = 'items.itm.img'
+# Budget for the sprite surfaces kept by SpriteProvider between renders.
+SPRITE_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def generate_floor(
+        options: Options, in_floor: MappaFloorProtocol, tileset: TilesetData, sampler: Optional['FloorSampler'] = None
+) -> BytesIO:
+    return encode_surface(draw_floor(options, in_floor, tileset, sampler), options.encoding)
+
+
+def generate_floor_layers(
+        options: Options, in_floor: MappaFloorProtocol, tileset: TilesetData, sampler: Optional['FloorSampler'] = None
+) -> Dict[str, BytesIO]:
+    """
+    Like `generate_floor`, but returns all layers of FLOOR_LAYERS as separate images (encoded as set in the options),
+    from the same generated floor. Layers hidden by the options are included too, so clients can toggle them.
+    """
+    return {
+        layer: encode_surface(surface, options.encoding)
+        for layer, surface in draw_floor_layers(options, in_floor, tileset, sampler).items()
+    }
+
+
+def draw_floor_layers(
+        options: Options, in_floor: MappaFloorProtocol, tileset: TilesetData, sampler: Optional['FloorSampler'] = None
+) -> Dict[str, cairo.ImageSurface]:
+    """Like `generate_floor_layers`, but returns the drawn surfaces instead of encoding them."""
+    return _floor_drawer(options, in_floor, tileset, sampler).draw_layers()
+
+
+def _floor_drawer(
+        options: Options, in_floor: MappaFloorProtocol, tileset: TilesetData, sampler: Optional['FloorSampler']
+) -> 'FixedRoomDrawer':
+    actions = generate_layout(in_floor, options.seed, options.patches, sampler)
+    if actions is None:
+        raise UserError("Internal Error", "The floor generator failed to generate a floor from these settings.")
+
+    fixed_floor = FixedFloor.new(SIZE_Y, SIZE_X, actions)
+    return FixedRoomDrawer(options, fixed_floor, *tileset)
+
+
+def draw_floor(
+        options: Options, in_floor: MappaFloorProtocol, tileset: TilesetData, sampler: Optional['FloorSampler'] = None
+) -> cairo.ImageSurface:
+    """Like `generate_floor`, but returns the drawn surface instead of encoding it."""
+    return _floor_drawer(options, in_floor, tileset, sampler).draw()
 
 
-def generate_floor(options: Options, in_floor: MappaFloorProtocol, tileset: Tuple[Dma, Dpc, Dpci, Dpl, Dpla]) -> BytesIO:
+class WeightedSampler:
+    """
+    Finds the first entry (in the original order) whose weight is greater than a random number.
+    Only the entries that raise the running maximum of the weights can ever be found, so those are kept
+    in a sorted list and looked up with bisect. The result is the same as scanning all entries.
+    """
+    def __init__(self, entries: Iterable[Tuple[int, int]]):
+        self._weights: List[int] = []
+        self._values: List[int] = []
+        for value, weight in entries:
+            if weight != 0 and (len(self._weights) == 0 or weight > self._weights[-1]):
+                self._weights.append(weight)
+                self._values.append(value)
+
+    def find(self, ridx: int, fallback: int) -> int:
+        i = bisect_right(self._weights, ridx)
+        if i < len(self._values):
+            return self._values[i]
+        return fallback
+
+
+class ItemSampler:
+    """Picks an item category and then an item of that category, like the game does for item spawns."""
+    def __init__(self, item_list):
+        self._items = [(itm, prop) for itm, prop in item_list.items.items() if prop != GUARANTEED and prop != 0]
+        self.categories = WeightedSampler(item_list.categories.items())
+        self._by_category: Dict[int, WeightedSampler] = {}
+
+    def find(self, ridx_cat: int, ridx_itm: int) -> int:
+        cat = self.categories.find(ridx_cat, 6)  # Poké - fallback
+        if cat not in self._by_category:
+            item_ids = set(ITEM_CATEGORIES[cat].item_ids())
+            self._by_category[cat] = WeightedSampler((itm, prop) for itm, prop in self._items if itm in item_ids)
+        return self._by_category[cat].find(ridx_itm, POKE_ID)  # Poké - fallback
+
+
+class FloorSampler:
+    """Samplers for the monsters, items and traps of a floor. Build once per floor and reuse for every seed."""
+    def __init__(self, in_floor: MappaFloorProtocol):
+        self.monsters = WeightedSampler((m.md_index, m.main_spawn_weight) for m in in_floor.monsters)
+        self.floor_items = ItemSampler(in_floor.floor_items)
+        self.buried_items = ItemSampler(in_floor.buried_items)
+        self.traps = WeightedSampler(in_floor.traps.weights.items())
+
+
+def generate_layout(
+        in_floor: MappaFloorProtocol, seed: int, patches: bool = True, sampler: Optional[FloorSampler] = None
+) -> Optional[List[DirectRule]]:
+    """
+    Generates the floor layout and assigns the monsters, items and traps, without drawing anything.
+    Returns one rule per tile (row by row), or None if the generator failed.
+    """
     try:
-        rng = random.Random(int(options.seed))
+        rng = random.Random(int(seed))
     except ValueError:
-        rng = random.Random(hash(options.seed))
+        rng = random.Random(hash(seed))
 
     floor: List[Tile] = DungeonFloorGenerator(
-        unknown_dungeon_chance_patch_applied=options.patches,
+        unknown_dungeon_chance_patch_applied=patches,
         gen_properties=RandomGenProperties.default(rng)
     ).generate(in_floor.layout, max_retries=3, flat=True)
     if floor is None:
-        raise UserError("Internal Error", "The floor generator failed to generate a floor from these settings.")
+        return None
 
+    if sampler is None:
+        sampler = FloorSampler(in_floor)
     actions = []
-    warnings = set()
     open_guaranteed_floor = set(x for x, y in in_floor.floor_items.items.items() if y == GUARANTEED)
     open_guaranteed_buried = set(x for x, y in in_floor.buried_items.items.items() if y == GUARANTEED)
     for x in floor:
@@ -260,15 +708,7 @@ def generate_floor(options: Options, in_floor: MappaFloorProtocol, tileset: Tupl
         if x.typ == TileType.PLAYER_SPAWN:
             idx = 1  # bulbasaur
         if x.typ == TileType.ENEMY:
-            ridx = rng.randrange(0, 10000)
-            last = 383  # Kecleon - fallback
-            invalid = True
-            for m in in_floor.monsters:
-                if m.main_spawn_weight > ridx and m.main_spawn_weight != 0:
-                    last = m.md_index
-                    invalid = False
-                    break
-            idx = last
+            idx = sampler.monsters.find(rng.randrange(0, 10000), 383)  # Kecleon - fallback
         if x.typ == TileType.ITEM and len(open_guaranteed_floor) > 0:
             idx = open_guaranteed_floor.pop()
         if x.typ == TileType.BURIED_ITEM and len(open_guaranteed_buried) > 0:
@@ -276,32 +716,476 @@ def generate_floor(options: Options, in_floor: MappaFloorProtocol, tileset: Tupl
         if x.typ == TileType.ITEM or x.typ == TileType.BURIED_ITEM:
             ridx_cat = rng.randrange(0, 10000)
             ridx_itm = rng.randrange(0, 10000)
-            last_cat = 6  # Poké - fallback
-            last_item = POKE_ID  # Poké - fallback
-            item_list = in_floor.floor_items
+            item_sampler = sampler.floor_items
             if x.typ == TileType.BURIED_ITEM:
-                item_list = in_floor.buried_items
-            for c, prop in item_list.categories.items():
-                if prop > ridx_cat and prop != 0:
-                    last_cat = c
-                    break
-            for itm, prop in item_list.items.items():
-                if prop > ridx_itm and prop != GUARANTEED and prop != 0 and itm in ITEM_CATEGORIES[last_cat].item_ids():
-                    last_item = itm
-                    break
-            idx = last_item
+                item_sampler = sampler.buried_items
+            idx = item_sampler.find(ridx_cat, ridx_itm)
         if x.typ == TileType.TRAP:
-            ridx = rng.randrange(0, 10000)
-            last = 0  # fallback
-            for trap, weight in in_floor.traps.weights.items():
-                if weight > ridx and weight != 0:
-                    last = trap
-                    break
-            idx = last
+            idx = sampler.traps.find(rng.randrange(0, 10000), 0)  # fallback
         actions.append(DirectRule(x, idx))
 
-    fixed_floor = FixedFloor.new(SIZE_Y, SIZE_X, actions)
-    return FixedRoomDrawer(options, fixed_floor, *tileset).draw_to_png()
+    return actions
+
+
+class LayoutSummary(NamedTuple):
+    """Compact result of generating a floor layout for one seed (see `sweep_seeds`)."""
+    seed: int
+    failed: bool
+    # Terrain (DmaType value) of every tile, row by row. Empty if the generator failed.
+    terrain: bytes
+    # Number of rooms on the floor
+    rooms: int
+    # Whether the floor contains a Kecleon shop
+    kecleon_shop: bool
+    # (x, y, tile type name, monster/item/trap ID) of every tile with an entity.
+    entities: List[Tuple[int, int, str, Optional[int]]]
+
+
+def summarize_layout(seed: int, actions: Optional[List[DirectRule]]) -> LayoutSummary:
+    if actions is None:
+        return LayoutSummary(seed, True, b'', 0, False, [])
+    rooms = set()
+    kecleon_shop = False
+    entities = []
+    for i, action in enumerate(actions):
+        tile = action.tile
+        if tile.terrain == DmaType.FLOOR and tile.room_index < 0xF0:
+            rooms.add(tile.room_index)
+        if tile.room_type == RoomType.KECLEON_SHOP:
+            kecleon_shop = True
+        if tile.typ in (TileType.PLAYER_SPAWN, TileType.ENEMY, TileType.ITEM, TileType.BURIED_ITEM,
+                        TileType.TRAP, TileType.STAIRS):
+            # The generator returns rows of SIZE_Y (56) tiles
+            entities.append((i % SIZE_Y, i // SIZE_Y, tile.typ.name, action.itmtpmon_id))
+    return LayoutSummary(
+        seed, False, bytes(action.tile.terrain for action in actions), len(rooms), kecleon_shop, entities
+    )
+
+
+def sweep_seeds(
+        in_floor: MappaFloorProtocol, seeds: Iterable[int], patches: bool = True,
+        sampler: Optional[FloorSampler] = None
+) -> List[LayoutSummary]:
+    """Generates the layout of the floor for every seed. No drawing or sprite loading is done."""
+    if sampler is None:
+        sampler = FloorSampler(in_floor)
+    return [summarize_layout(seed, generate_layout(in_floor, seed, patches, sampler)) for seed in seeds]
+
+
+class CompiledFloor(NamedTuple):
+    """A parsed floor definition, ready to be generated with any seed and options."""
+    xml_hash: str
+    floor: MappaFloorProtocol
+    tileset_id: int
+    sampler: FloorSampler
+
+
+class FloorCache:
+    """
+    Cache of compiled floor definitions, keyed by the SHA-256 of the XML.
+    Files are additionally remembered by path, modification time and size, so unchanged files are not even read.
+    """
+    def __init__(self, max_entries: int = 64):
+        self._entries: LruCache[str, CompiledFloor] = LruCache(max_entries)
+        self._files: Dict[str, Tuple[int, int, str]] = {}
+
+    def compile(self, xml_data: bytes) -> CompiledFloor:
+        xml_hash = hashlib.sha256(xml_data).hexdigest()
+        compiled = self._entries.get(xml_hash)
+        if compiled is not None:
+            return compiled
+
+        root = ElementTree.fromstring(xml_data)
+        floor_layout = root.find('FloorLayout')
+        if floor_layout is None:
+            raise UserError("Invalid XML", "The XML file does not contain a 'FloorLayout' element.")
+        floor = mappa_floor_from_xml(root, ITEM_CATEGORIES_BY_NAME)
+        compiled = CompiledFloor(xml_hash, floor, int(floor_layout.get('tileset', 0)), FloorSampler(floor))
+        return self._entries.put(xml_hash, compiled)
+
+    def compile_file(self, path: str) -> CompiledFloor:
+        stat = os.stat(path)
+        known = self._files.get(path)
+        if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            compiled = self._entries.get(known[2])
+            if compiled is not None:
+                return compiled
+        with open(path, 'rb') as f:
+            compiled = self.compile(f.read())
+        self._files[path] = (stat.st_mtime_ns, stat.st_size, compiled.xml_hash)
+        return compiled
+
+    def clear(self):
+        self._entries.clear()
+        self._files.clear()
+
+
+FLOOR_CACHE = FloorCache()
+
+
+# Default budgets of RENDER_CACHE
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+
+def render_cache_key(xml_hash: str, tileset_key: str, options: Options) -> str:
+    """
+    Key of a finished render in the RenderCache: The compiled floor hash, the tileset (see `tileset_cache_key`)
+    and the normalized options, which include the seed and the patch flag.
+    """
+    return hashlib.sha256(f"{xml_hash}\n{tileset_key}\n{options.normalized()}".encode()).hexdigest()
+
+
+class RenderCache:
+    """
+    Content-addressed cache of finished renders (the encoded image bytes), keyed by `render_cache_key`.
+    Entries are kept in memory (LRU, up to `max_bytes`) and, if `cache_dir` is set, also on disk (LRU by
+    modification time, up to `max_disk_bytes`). The directory can be shared by several processes: Every process
+    reads the files the others wrote, and the disk budget applies to all files in it.
+    """
+    def __init__(
+            self, max_bytes: int = RENDER_CACHE_BYTES, cache_dir: Optional[str] = None,
+            max_disk_bytes: int = RENDER_CACHE_DISK_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: LruCache[str, bytes] = LruCache(max_bytes)
+        # Number and total size of the files in cache_dir, as of the last write
+        self._disk_entries = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key: str, render: Callable[[], bytes]) -> bytes:
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    @property
+    def max_bytes(self) -> int:
+        return self._entries.max_size
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes: int):
+        self._entries.max_size = max_bytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                data = self._read_from_disk(key)
+                if data is None:
+                    self.misses += 1
+                    return None
+                self._entries.put(key, data, len(data))
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._entries.put(key, data, len(data))
+            self._write_to_disk(key, data)
+
+    def clear(self):
+        """Drops the entries in memory. The files on disk are kept."""
+        self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'entries': len(self._entries),
+            'bytes': self._entries.size,
+            'max_bytes': self.max_bytes,
+            'disk_entries': self._disk_entries,
+            'disk_bytes': self._disk_bytes,
+            'max_disk_bytes': self.max_disk_bytes,
+        }
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.render")
+
+    def _read_from_disk(self, key: str) -> Optional[bytes]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            # Not rendered yet, or evicted (possibly by another process sharing the directory)
+            return None
+        try:
+            # Mark as recently used
+            os.utime(self._disk_path(key))
+        except OSError:
+            pass
+        return data
+
+    def _write_to_disk(self, key: str, data: bytes):
+        if self.cache_dir is None or len(data) > self.max_disk_bytes:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_file_atomic(self._disk_path(key), data)
+        self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        """Removes the least recently used files until all files in `cache_dir` fit into `max_disk_bytes`."""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.render'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        count = len(files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by another process
+                pass
+            total -= size
+            count -= 1
+        self._disk_entries = count
+        self._disk_bytes = total
+
+
+RENDER_CACHE = RenderCache()
+
+
+# Number of tiles of outside terrain drawn around the floor
+OUTSIDE_PADDING = 5
+TILE_RULE_TERRAIN = {
+    FloorType.FLOOR: DmaType.FLOOR,
+    FloorType.WALL: DmaType.WALL,
+    FloorType.SECONDARY: DmaType.WATER,
+    FloorType.FLOOR_OR_WALL: DmaType.WALL,
+}
+
+
+def _action_terrain(action) -> int:
+    if isinstance(action, DirectRule):
+        return action.tile.terrain
+    if isinstance(action, TileRule):
+        return TILE_RULE_TERRAIN[action.tr_type.floor_type]
+    raise ValueError("Invalid rule type while rendering.")
+
+
+# Autotiling: Vectorized version of DmaDrawer.get_mappings_for_rules
+DMA_TYPES = (DmaType.WALL, DmaType.WATER, DmaType.FLOOR)
+# (bit, dy, dx) of every neighbor of a tile
+DMA_NEIGHBOR_OFFSETS = (
+    (DmaNeighbor.SOUTH, 1, 0),
+    (DmaNeighbor.SOUTH_EAST, 1, 1),
+    (DmaNeighbor.EAST, 0, 1),
+    (DmaNeighbor.NORTH_EAST, -1, 1),
+    (DmaNeighbor.NORTH, -1, 0),
+    (DmaNeighbor.NORTH_WEST, -1, -1),
+    (DmaNeighbor.WEST, 0, -1),
+    (DmaNeighbor.SOUTH_WEST, 1, -1),
+)
+
+
+def dma_neighbor_masks(grid: np.ndarray, treat_outside_as_wall: bool = True) -> np.ndarray:
+    """
+    The neighbor mask (DmaNeighbor bits) of every tile of a terrain grid (DmaType values), computed the same way as
+    `skytemple_files.graphics.dma.util.get_tile_neighbors`: For walls and water a bit is set if that neighbor is of
+    the same type, for floors if that neighbor is not a wall. With `treat_outside_as_wall`, neighbors outside the
+    grid count as wall/water, otherwise as floor.
+    """
+    h, w = grid.shape
+    padded = np.pad(grid.astype(np.int16), 1, constant_values=-1)
+    # The terrain type that is checked for in the neighbors of each tile
+    solid_type = np.where(grid == DmaType.WATER, DmaType.WATER, DmaType.WALL)
+    masks = np.zeros(grid.shape, dtype=np.uint8)
+    for bit, dy, dx in DMA_NEIGHBOR_OFFSETS:
+        neighbor = padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+        solid = np.where(neighbor == -1, treat_outside_as_wall, neighbor == solid_type)
+        masks |= np.where(solid, np.uint8(bit), np.uint8(0))
+    return np.where(grid == DmaType.FLOOR, masks ^ np.uint8(0xFF), masks)
+
+
+_DMA_CHUNK_TABLES: LruCache[tuple, tuple] = LruCache(TILESET_CACHE_ENTRIES)
+
+
+def dma_chunk_table(dma: Dma, variation_index: int = 0) -> np.ndarray:
+    """Chunk index for every (DmaType, neighbor mask) of the DMA. Cached for the most recently used DMAs."""
+    def build() -> np.ndarray:
+        table = np.zeros((max(DMA_TYPES) + 1, 256), dtype=np.int32)
+        for typ in DMA_TYPES:
+            for mask in range(256):
+                table[typ, mask] = dma.get(typ, mask)[variation_index]
+        return table
+
+    return cached_by_identity(_DMA_CHUNK_TABLES, (dma,), build, variation_index)
+
+
+def dma_mappings(dma: Dma, grid: np.ndarray, variation_index: int = 0) -> np.ndarray:
+    """
+    The DPC chunk index of every tile of the terrain grid. Same result as
+    `DmaDrawer.get_mappings_for_rules(grid.tolist(), variation_index=variation_index, treat_outside_as_wall=True)`.
+    """
+    return dma_chunk_table(dma, variation_index)[grid, dma_neighbor_masks(grid)]
+
+
+def dma_mappings_match(dma: Dma, grid: np.ndarray, variation_index: int = 0) -> bool:
+    """Checks `dma_mappings` against the DmaDrawer implementation it replaces."""
+    expected = DmaDrawer(dma).get_mappings_for_rules(
+        grid.tolist(), variation_index=variation_index, treat_outside_as_wall=True
+    )
+    return dma_mappings(dma, grid, variation_index).tolist() == expected
+
+
+# Tile atlas: All DPC chunks of a tileset, pre-rendered as premultiplied BGRA (cairo's ARGB32 byte order)
+CHUNK_DIM = DPC_TILING_DIM * DPCI_TILE_DIM
+
+
+def premultiply_bgra(rgba: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Converts an (..., 4) RGBA array to premultiplied BGRA, with the same rounding as Pillow's `BGRa` raw mode.
+    If given, the result is written into `out` (eg. the `surface_array` of a surface) instead of a new array.
+    """
+    if out is None:
+        out = np.empty(rgba.shape, dtype=np.uint8)
+    alpha = rgba[..., 3:4].astype(np.uint16)
+    tmp = rgba[..., 2::-1] * alpha + 128
+    out[..., :3] = ((tmp >> 8) + tmp) >> 8
+    out[..., 3:4] = alpha
+    return out
+
+
+_TILE_ATLASES: LruCache[tuple, tuple] = LruCache(TILESET_CACHE_ENTRIES)
+
+
+def tile_atlas(dpc: Dpc, dpci: Dpci, dpl: Dpl) -> np.ndarray:
+    """
+    All chunks of the tileset as a (chunk, CHUNK_DIM, CHUNK_DIM, 4) array of premultiplied BGRA pixels.
+    Cached for the most recently used tilesets.
+    """
+    def build() -> np.ndarray:
+        # The chunks are rendered below each other. Like DmaDrawer, the terrain is drawn fully opaque.
+        chunks = dpc.chunks_to_pil(dpci, dpl.palettes, 1)
+        rgba = np.asarray(chunks.convert('RGB').convert('RGBA')).reshape((-1, CHUNK_DIM, CHUNK_DIM, 4))
+        atlas = premultiply_bgra(rgba)
+        atlas.setflags(write=False)
+        return atlas
+
+    return cached_by_identity(_TILE_ATLASES, (dpc, dpci, dpl), build)
+
+
+def surface_array(surface: cairo.ImageSurface) -> np.ndarray:
+    """A writable (height, width, 4) view of the pixel buffer of an ARGB32 surface. Call `mark_dirty` after writing."""
+    return np.ndarray(
+        shape=(surface.get_height(), surface.get_width(), 4), dtype=np.uint8,
+        buffer=surface.get_data(), strides=(surface.get_stride(), 4, 1)
+    )
+
+
+def surface_tiles(surface: cairo.ImageSurface, rows: int, cols: int) -> np.ndarray:
+    """
+    A writable (rows, cols, CHUNK_DIM, CHUNK_DIM, 4) view of the top left tiles of an ARGB32 surface,
+    so chunks can be copied straight into their place in the buffer. Call `mark_dirty` after writing.
+    """
+    # (rows * y, cols * x, c) -> (rows, cols, y, x, c)
+    return surface_array(surface)[:rows * CHUNK_DIM, :cols * CHUNK_DIM].reshape(
+        (rows, CHUNK_DIM, cols, CHUNK_DIM, 4)
+    ).transpose((0, 2, 1, 3, 4))
+
+
+# Room for five overlays of the full map size (1584x1008 pixels, about 6 MiB each)
+GRID_OVERLAY_CACHE_BYTES = 32 * 1024 * 1024
+_GRID_OVERLAYS: LruCache[tuple, cairo.ImageSurface] = LruCache(GRID_OVERLAY_CACHE_BYTES)
+
+
+def grid_overlay(
+        width: int, height: int, cell_size: int = CHUNK_DIM, color: Tuple[float, float, float, float] = (0, 0, 0, 0.5)
+) -> cairo.ImageSurface:
+    """
+    A transparent surface with 1px grid lines every `cell_size` pixels, starting at the top left.
+    Rendered once per size and color and cached for the most recently used ones.
+    """
+    key = (width, height, cell_size, tuple(color))
+    surface = _GRID_OVERLAYS.get(key)
+    if surface is not None:
+        return surface
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ctx = cairo.Context(surface)
+    ctx.set_antialias(cairo.Antialias.NONE)
+    ctx.set_source_rgba(*color)
+    ctx.set_line_width(1.0)
+    # Lines are offset by 0.5 so they cover exactly one pixel column/row. Stroked once, so crossings are not
+    # blended twice.
+    for x in range(0, width + 1, cell_size):
+        ctx.move_to(x + 0.5, 0)
+        ctx.line_to(x + 0.5, height)
+    for y in range(0, height + 1, cell_size):
+        ctx.move_to(0, y + 0.5)
+        ctx.line_to(width, y + 0.5)
+    ctx.stroke()
+    surface.flush()
+    return _GRID_OVERLAYS.put(key, surface, surface.get_stride() * surface.get_height())
+
+
+# Entity layers, in drawing order. Entities in the "terrain" layer (key walls) are part of the terrain.
+ENTITY_LAYERS = ('terrain', 'kecleon', 'stairs', 'traps', 'buried', 'items', 'monsters')
+# All layers of `draw_layers`, in drawing order
+FLOOR_LAYERS = ENTITY_LAYERS + ('grid',)
+
+
+def visible_layers(options: 'Options') -> List[str]:
+    """The layers of FLOOR_LAYERS that make up the image `generate_floor` renders with these options."""
+    shown = {
+        'terrain': True,
+        'kecleon': options.kecleon,
+        'stairs': options.stairs,
+        'traps': options.traps,
+        'buried': options.burieditems,
+        'items': options.flooritems,
+        'monsters': options.monsters,
+        'grid': options.grid,
+    }
+    return [layer for layer in FLOOR_LAYERS if shown[layer]]
+
+
+def composite_layers(layers: Dict[str, cairo.ImageSurface], visible: Iterable[str]) -> cairo.ImageSurface:
+    """Paints the visible layers (as returned by `FixedRoomDrawer.draw_layers`) on top of each other."""
+    terrain = layers['terrain']
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, terrain.get_width(), terrain.get_height())
+    ctx = cairo.Context(surface)
+    visible = set(visible)
+    for layer in FLOOR_LAYERS:
+        if layer in visible:
+            ctx.set_source_surface(layers[layer], 0, 0)
+            ctx.paint()
+    surface.flush()
+    return surface
+
+
+class EntitySprite(NamedTuple):
+    """
+    A sprite drawn on top of the terrain. Except for monsters, all sprites are CHUNK_DIM x CHUNK_DIM
+    and (x, y) is the top left of their tile.
+    """
+    layer: str
+    # Entities with the same key share their sprite
+    key: tuple
+    # As returned by the SpriteProvider: (surface, x, y, w, h)
+    sprite: Tuple[cairo.Surface, int, int, int, int]
+    x: float
+    y: float
 
 
 class FixedRoomDrawer:
@@ -319,119 +1203,133 @@ class FixedRoomDrawer:
 
         self.mouse_y = 99999
 
-        self.sprite_provider = SpriteProvider()
+        self.sprite_provider = SpriteProvider.shared()
 
-    def draw_to_png(self) -> BytesIO:
+    def draw(self) -> cairo.ImageSurface:
         size_w = (self.fixed_floor.width + 10) * DPC_TILING_DIM * DPCI_TILE_DIM
         size_h = (self.fixed_floor.height + 10) * DPC_TILING_DIM * DPCI_TILE_DIM
 
         surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size_w, size_h)
-        ctx: cairo.Context = cairo.Context(surface)
 
-        ctx.set_antialias(cairo.Antialias.NONE)
+        # Build the terrain grid, padded with the outside terrain, and render it straight into the surface
+        self.draw_dungeon(surface, self.terrain_grid())
 
-        # Iterate over floor and render it
-        rules = []
-        draw_outside_as_second_terrain = any(action.tr_type == TileRuleType.SECONDARY_HALLWAY_VOID_ALL
-                                             for action in self.fixed_floor.actions if isinstance(action, TileRule))
-        outside = DmaType.WATER if draw_outside_as_second_terrain else DmaType.WALL
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        ridx = 0
-        for y in range(0, self.fixed_floor.height):
-            row = [outside, outside, outside, outside, outside]
-            rules.append(row)
-            for x in range(0, self.fixed_floor.width):
-                action = self.fixed_floor.actions[ridx]
-                if isinstance(action, TileRule):
-                    if action.tr_type.floor_type == FloorType.FLOOR:
-                        row.append(DmaType.FLOOR)
-                    elif action.tr_type.floor_type == FloorType.WALL:
-                        row.append(DmaType.WALL)
-                    elif action.tr_type.floor_type == FloorType.SECONDARY:
-                        row.append(DmaType.WATER)
-                    elif action.tr_type.floor_type == FloorType.FLOOR_OR_WALL:
-                        row.append(DmaType.WALL)
-                elif isinstance(action, EntityRule):
-                    raise ValueError("Invalid rule type while rendering.")
-                elif isinstance(action, DirectRule):
-                    row.append(action.tile.terrain)
-                ridx += 1
-            row += [outside, outside, outside, outside, outside]
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-        rules.append([outside] * (self.fixed_floor.width + 10))
-
-        dungeon = self.get_dungeon(rules)
-        ctx.set_source_surface(dungeon, 0, 0)
-        ctx.get_source().set_filter(cairo.Filter.NEAREST)
-        ctx.paint()
+        ctx: cairo.Context = cairo.Context(surface)
+        ctx.set_antialias(cairo.Antialias.NONE)
 
         # Draw Pokémon, items, traps, etc.
-        ridx = 0
-        for y in range(0, self.fixed_floor.height):
-            y += 5
-            for x in range(0, self.fixed_floor.width):
-                x += 5
-                action = self.fixed_floor.actions[ridx]
-                sx = DPC_TILING_DIM * DPCI_TILE_DIM * x
-                sy = DPC_TILING_DIM * DPCI_TILE_DIM * y
-                self._draw_action(ctx, action, sx, sy)
-                ridx += 1
-
-        # -------------------------
-        # DRAW GRID ON TOP OF EVERYTHING
+        self.draw_entities(ctx, self.collect_entities())
 
+        # Grid on top of everything
         if self.options.grid:
-            # -------------------------
-            # cell size (pixels) per logical tile (matches how sprites are positioned)
-            cell_size = DPC_TILING_DIM * DPCI_TILE_DIM
-
-            # Color: RGBA black with alpha ~0.5 (use set_source_rgba)
-            # Cairo uses 0..1 floats for colors.
-            ctx.set_source_rgba(0.0, 0.0, 0.0, 0.5)
-
-            # Use a hairline of 1 device pixel (we offset by 0.5 so lines fall between pixels on some backends)
-            ctx.set_line_width(1.0)
-
-            # Build all vertical lines path
-            ctx.new_path()
-            x = 0
-            while x <= size_w:
-                # offset by 0.5 keeps lines sharp on many pixels backends
-                ctx.move_to(x + 0.5, 0)
-                ctx.line_to(x + 0.5, size_h)
-                x += cell_size
-
-            # Build all horizontal lines path
-            y = 0
-            while y <= size_h:
-                ctx.move_to(0, y + 0.5)
-                ctx.line_to(size_w, y + 0.5)
-                y += cell_size
-
-        # Stroke once for performance
-        ctx.stroke()
-        # -------------------------
-
-        obj = BytesIO()
-        surface.write_to_png(obj)
-        obj.seek(0)
-        return obj
-
-    def get_dungeon(self, rules: List[List[DmaType]]) -> cairo.Surface:
-        dma_drawer = DmaDrawer(self.dma)
-        mappings = dma_drawer.get_mappings_for_rules(rules, treat_outside_as_wall=True, variation_index=0)
-        return pil_to_cairo_surface(
-            dma_drawer.draw(mappings, self.dpci, self.dpc, self.dpl, None)[0].convert('RGBA')
-        )
+            ctx.set_source_surface(self.grid_layer(size_w, size_h), 0, 0)
+            ctx.paint()
+
+        return surface
+
+    def draw_layers(self) -> Dict[str, cairo.ImageSurface]:
+        """
+        Draws every layer of FLOOR_LAYERS on its own surface, including those the options hide.
+        All but the terrain are transparent. See `composite_layers` and `visible_layers`.
+        The grid layer is shared between renders, do not draw on it.
+        """
+        size_w = (self.fixed_floor.width + 10) * DPC_TILING_DIM * DPCI_TILE_DIM
+        size_h = (self.fixed_floor.height + 10) * DPC_TILING_DIM * DPCI_TILE_DIM
+        entities = self.collect_entities(all_layers=True)
+
+        layers = {}
+        for layer in ENTITY_LAYERS:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size_w, size_h)
+            if layer == 'terrain':
+                self.draw_dungeon(surface, self.terrain_grid())
+            ctx = cairo.Context(surface)
+            ctx.set_antialias(cairo.Antialias.NONE)
+            self.draw_entities(ctx, entities, (layer,))
+            surface.flush()
+            layers[layer] = surface
+        layers['grid'] = self.grid_layer(size_w, size_h)
+        return layers
 
-    def _draw_action(self, ctx, action, sx, sy):
+    def draw_to_png(self) -> BytesIO:
+        """Draws the floor, encoded as set in the options (PNG unless `+encoding:` says otherwise)."""
+        return encode_surface(self.draw(), self.options.encoding)
+
+    def grid_layer(self, width: int, height: int) -> cairo.ImageSurface:
+        """The grid overlay of the options on a transparent surface. Shared between renders, do not draw on it."""
+        return grid_overlay(width, height, self.options.grid_size, self.options.grid_color)
+
+    def terrain_grid(self) -> np.ndarray:
+        """The DmaType values of all tiles (row by row), with OUTSIDE_PADDING tiles of outside terrain around."""
+        draw_outside_as_second_terrain = any(action.tr_type == TileRuleType.SECONDARY_HALLWAY_VOID_ALL
+                                             for action in self.fixed_floor.actions if isinstance(action, TileRule))
+        outside = DmaType.WATER if draw_outside_as_second_terrain else DmaType.WALL
+        terrain = np.fromiter(
+            (_action_terrain(action) for action in self.fixed_floor.actions),
+            dtype=np.uint8, count=self.fixed_floor.width * self.fixed_floor.height
+        ).reshape((self.fixed_floor.height, self.fixed_floor.width))
+        return np.pad(terrain, OUTSIDE_PADDING, constant_values=outside)
+
+    def draw_dungeon(self, surface: cairo.ImageSurface, grid: np.ndarray):
+        """Copies the chunks for the terrain grid from the tile atlas into the top left of the surface."""
+        atlas = tile_atlas(self.dpc, self.dpci, self.dpl)
+        mappings = dma_mappings(self.dma, grid)
+        surface.flush()
+        tiles = surface_tiles(surface, *mappings.shape)
+        # Row by row, so at most one row of chunks is gathered outside the surface
+        for row, row_mappings in zip(tiles, mappings):
+            row[...] = atlas[row_mappings]
+        surface.mark_dirty()
+
+    def collect_entities(self, all_layers: bool = False) -> List[EntitySprite]:
+        """
+        All sprites to draw on top of the terrain, in row-major order of their tiles.
+        With `all_layers`, the entities hidden by the options are included as well.
+        """
+        entities: List[EntitySprite] = []
+        width = self.fixed_floor.width
+        for ridx, action in enumerate(self.fixed_floor.actions):
+            if isinstance(action, DirectRule) and action.tile.typ == TileType.GENERIC \
+                    and action.tile.room_type != RoomType.KECLEON_SHOP:
+                # Most tiles of the floor
+                continue
+            sx = CHUNK_DIM * (ridx % width + OUTSIDE_PADDING)
+            sy = CHUNK_DIM * (ridx // width + OUTSIDE_PADDING)
+            self._collect_action(entities, action, sx, sy, all_layers)
+        return entities
+
+    def draw_entities(self, ctx: cairo.Context, entities: List[EntitySprite], layers: Iterable[str] = ENTITY_LAYERS):
+        """
+        Composites the entities layer by layer. Tile sprites are drawn with one fill per distinct sprite,
+        monsters one by one, as they can overlap each other.
+        """
+        for layer in layers:
+            groups: 'OrderedDict[tuple, Tuple[cairo.SurfacePattern, List[EntitySprite]]]' = OrderedDict()
+            for entity in entities:
+                if entity.layer == layer:
+                    if entity.key not in groups:
+                        pattern = cairo.SurfacePattern(entity.sprite[0])
+                        pattern.set_filter(cairo.Filter.NEAREST)
+                        groups[entity.key] = (pattern, [])
+                    groups[entity.key][1].append(entity)
+            if layer == 'monsters':
+                for entity in entities:
+                    if entity.layer == layer:
+                        pattern = groups[entity.key][0]
+                        pattern.set_matrix(cairo.Matrix(x0=-entity.x, y0=-entity.y))
+                        ctx.set_source(pattern)
+                        ctx.rectangle(entity.x, entity.y, entity.sprite[3], entity.sprite[4])
+                        ctx.fill()
+            else:
+                # Tile sprites repeat every tile, so the pattern lines up with all of them.
+                for pattern, group in groups.values():
+                    pattern.set_extend(cairo.Extend.REPEAT)
+                    ctx.set_source(pattern)
+                    for entity in group:
+                        ctx.rectangle(entity.x, entity.y, CHUNK_DIM, CHUNK_DIM)
+                    ctx.fill()
+
+    def _collect_action(self, entities: List[EntitySprite], action, sx, sy, all_layers: bool):
+        options = self.options
         if isinstance(action, EntityRule):
             raise ValueError("Invalid rule type while rendering.")
         elif isinstance(action, TileRule):
@@ -449,141 +1347,511 @@ class FixedRoomDrawer:
                 raise ValueError("Invalid rule type while rendering.")
             # Key walls
             if action.tr_type == TileRuleType.FL_WA_ROOM_FLAG_0C or action.tr_type == TileRuleType.FL_WA_ROOM_FLAG_0D:
-                sprite, x, y, w, h = self.sprite_provider.get_for_trap(31)
-                ctx.translate(sx, sy)
-                ctx.set_source_surface(sprite)
-                ctx.get_source().set_filter(cairo.Filter.NEAREST)
-                ctx.paint()
-                ctx.translate(-sx, -sy)
+                entities.append(EntitySprite('terrain', ('trap', 31), self.sprite_provider.get_for_trap(31), sx, sy))
             # Warp zone
             if action.tr_type == TileRuleType.WARP_ZONE or action.tr_type == TileRuleType.WARP_ZONE_2:
-                if self.options.stairs:
-                    self._draw_stairs(ctx, sx, sy)
+                if all_layers or options.stairs:
+                    self._collect_stairs(entities, sx, sy)
         elif isinstance(action, DirectRule):
             if action.tile.room_type == RoomType.KECLEON_SHOP:
-                if self.options.kecleon:
-                    sprite, x, y, w, h = self.sprite_provider.get_for_trap(30)
-                    ctx.translate(sx, sy)
-                    ctx.set_source_surface(sprite)
-                    ctx.get_source().set_filter(cairo.Filter.NEAREST)
-                    ctx.paint()
-                    ctx.translate(-sx, -sy)
+                if all_layers or options.kecleon:
+                    entities.append(EntitySprite('kecleon', ('trap', 30), self.sprite_provider.get_for_trap(30), sx, sy))
             if action.tile.typ == TileType.PLAYER_SPAWN or action.tile.typ == TileType.ENEMY:
-                if self.options.monsters:
-                    self._draw_pokemon(ctx, action.itmtpmon_id, action.direction, sx, sy)
+                if all_layers or options.monsters:
+                    self._collect_pokemon(entities, action.itmtpmon_id, action.direction, sx, sy)
             if action.tile.typ == TileType.STAIRS:
-                if self.options.stairs:
-                    self._draw_stairs(ctx, sx, sy)
+                if all_layers or options.stairs:
+                    self._collect_stairs(entities, sx, sy)
             if action.tile.typ == TileType.TRAP:
-                if self.options.traps:
-                    self._draw_trap(ctx, action.itmtpmon_id, sx, sy)
+                if all_layers or options.traps:
+                    self._collect_trap(entities, action.itmtpmon_id, sx, sy)
             if action.tile.typ == TileType.BURIED_ITEM:
-                if self.options.burieditems:
-                    self._draw_item(ctx, action.itmtpmon_id, sx, sy, buried=True)
+                if all_layers or options.burieditems:
+                    self._collect_item(entities, action.itmtpmon_id, sx, sy, buried=True)
             if action.tile.typ == TileType.ITEM:
-                if self.options.flooritems:
-                    self._draw_item(ctx, action.itmtpmon_id, sx, sy)
-
-    def _draw_pokemon(self, ctx, md_idx, direction, sx, sy):
-        sprite, cx, cy, w, h = self.sprite_provider.get_monster(md_idx, direction.ssa_id if direction is not None else 0)
-        ctx.translate(sx, sy)
-        ctx.set_source_surface(
-            sprite,
-            -cx + DPCI_TILE_DIM * DPC_TILING_DIM / 2,
-            -cy + DPCI_TILE_DIM * DPC_TILING_DIM * 0.75
-        )
-        ctx.get_source().set_filter(cairo.Filter.NEAREST)
-        ctx.paint()
-        ctx.translate(-sx, -sy)
-
-    def _draw_stairs(self, ctx, sx, sy):
-        sprite, x, y, w, h = self.sprite_provider.get_for_trap(28)
-        ctx.translate(sx, sy)
-        ctx.set_source_surface(sprite)
-        ctx.get_source().set_filter(cairo.Filter.NEAREST)
-        ctx.paint()
-        ctx.translate(-sx, -sy)
-
-    def _draw_trap(self, ctx, trap_id, sx, sy):
-        sprite, x, y, w, h = self.sprite_provider.get_for_trap(trap_id)
-        ctx.translate(sx, sy)
-        ctx.set_source_surface(sprite)
-        ctx.paint()
-        ctx.get_source().set_filter(cairo.Filter.NEAREST)
-        ctx.translate(-sx, -sy)
-
-    def _draw_item(self, ctx, item_id, sx, sy, buried=False):
-        sprite, x, y, w, h = self.sprite_provider.get_for_item(item_id)
-        ctx.translate(sx + 4, sy + 4)
-        ctx.set_source_surface(sprite)
-        ctx.get_source().set_filter(cairo.Filter.NEAREST)
-        if buried:
-            ctx.paint_with_alpha(0.5)
-        else:
-            ctx.paint()
-        ctx.translate(-sx - 4, -sy - 4)
+                if all_layers or options.flooritems:
+                    self._collect_item(entities, action.itmtpmon_id, sx, sy)
+
+    def _collect_pokemon(self, entities: List[EntitySprite], md_idx, direction, sx, sy):
+        direction_id = direction.ssa_id if direction is not None else 0
+        sprite = self.sprite_provider.get_monster(md_idx, direction_id)
+        entities.append(EntitySprite(
+            'monsters', ('monster', md_idx, direction_id), sprite,
+            sx - sprite[1] + CHUNK_DIM / 2,
+            sy - sprite[2] + CHUNK_DIM * 0.75
+        ))
+
+    def _collect_stairs(self, entities: List[EntitySprite], sx, sy):
+        entities.append(EntitySprite('stairs', ('trap', 28), self.sprite_provider.get_for_trap(28), sx, sy))
+
+    def _collect_trap(self, entities: List[EntitySprite], trap_id, sx, sy):
+        entities.append(EntitySprite('traps', ('trap', trap_id), self.sprite_provider.get_for_trap(trap_id), sx, sy))
+
+    def _collect_item(self, entities: List[EntitySprite], item_id, sx, sy, buried=False):
+        layer = 'buried' if buried else 'items'
+        entities.append(EntitySprite(
+            layer, (layer, item_id), self.sprite_provider.get_tile_for_item(item_id, buried), sx, sy
+        ))
+
+
+def cairo_surface_to_pil(surface: cairo.ImageSurface) -> Image.Image:
+    """Converts an ARGB32 surface to a straight (not premultiplied) RGBA Pillow image."""
+    surface.flush()
+    return Image.frombuffer(
+        'RGBA', (surface.get_width(), surface.get_height()), bytes(surface.get_data()),
+        'raw', 'BGRa', surface.get_stride(), 1
+    )
+
+
+def _quantize_exact(im: Image.Image) -> Image.Image:
+    """Palette image of the RGBA image. Exact if the image has at most 256 colors, otherwise quantized."""
+    rgba = np.asarray(im)
+    packed = rgba.view(np.uint32).reshape(rgba.shape[:2])
+    colors, indices = np.unique(packed, return_inverse=True)
+    if len(colors) > 256:
+        return im.quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    pal = Image.frombytes('P', im.size, indices.astype(np.uint8).tobytes())
+    pal.putpalette(colors.view(np.uint8).tobytes(), 'RGBA')
+    return pal
+
+
+def encode_surface(surface: cairo.ImageSurface, encoding: str = 'default') -> BytesIO:
+    """
+    Encodes the surface in one of the ENCODINGS:
+    default: cairo's PNG encoder. fast: PNG at zlib level 1. small: Palette PNG at zlib level 9.
+    webp: Lossless WebP. raw: The straight RGBA pixels.
+    """
+    obj = BytesIO()
+    if encoding == 'default':
+        surface.write_to_png(obj)
+    elif encoding == 'fast':
+        cairo_surface_to_pil(surface).save(obj, 'PNG', compress_level=1)
+    elif encoding == 'small':
+        _quantize_exact(cairo_surface_to_pil(surface)).save(obj, 'PNG', optimize=True)
+    elif encoding == 'webp':
+        if not features.check('webp'):
+            raise UserError("Invalid Option", "WebP encoding is not supported by this installation.")
+        cairo_surface_to_pil(surface).save(obj, 'WEBP', lossless=True, quality=50, method=0)
+    elif encoding == 'raw':
+        obj.write(cairo_surface_to_pil(surface).tobytes())
+    else:
+        raise ValueError(f"Unknown encoding: {encoding}")
+    obj.seek(0)
+    return obj
 
 
 def pil_to_cairo_surface(im, format=cairo.FORMAT_ARGB32) -> cairo.ImageSurface:
     """
+    The pixels are premultiplied straight into the buffer of the new surface, without intermediate copies.
+
     :param im: Pillow Image
     :param format: Pixel format for output surface
     """
+    if im.mode != 'RGBA':
+        im = im.convert('RGBA')
+    return rgba_to_cairo_surface(np.asarray(im), format)
+
+
+def rgba_to_cairo_surface(rgba: np.ndarray, format=cairo.FORMAT_ARGB32) -> cairo.ImageSurface:
+    """
+    :param rgba: (height, width, 4) array of straight RGBA pixels
+    :param format: Pixel format for output surface
+    """
     assert format in (cairo.FORMAT_RGB24, cairo.FORMAT_ARGB32), "Unsupported pixel format: %s" % format
-    arr = memoryview(bytearray(im.tobytes('raw', 'BGRa')))
-    surface = cairo.ImageSurface.create_for_data(arr, format, im.width, im.height)
+    surface = cairo.ImageSurface(format, rgba.shape[1], rgba.shape[0])
+    premultiply_bgra(rgba, out=surface_array(surface))
+    surface.mark_dirty()
     return surface
 
 
+class _EntryViews:
+    # Keeps the entries of a bin pack as views into the pack's data instead of copying them.
+    def _read_file(self, data: memoryview, toc_entry) -> memoryview:
+        s = toc_entry.pointer
+        return data[s:s + toc_entry.length]
+
+
+class ViewBinPack(_EntryViews, BinPack):
+    """
+    BinPack over a (memory-mapped) buffer. The entries are only copied out of the buffer when accessed
+    with `pack[index]`.
+    """
+    def __getitem__(self, key) -> bytes:
+        return self._files[key].tobytes()
+
+
+class ViewDungeonBinPack(_EntryViews, DungeonBinPack):
+    """DungeonBinPack over a (memory-mapped) buffer. The entries are only copied when their model is loaded."""
+    def get_raw(self, filename: str) -> bytes:
+        return bytes(super().get_raw(filename))
+
+    def _load_model(self, file_bytes, file_def):
+        return super()._load_model(bytes(file_bytes), file_def)
+
+
+class AssetStore:
+    """
+    Read-only memory maps of the asset files. The maps are backed by the OS page cache, so all processes rendering
+    from the same asset directory share one copy of the packs, and nothing is read until an entry is used.
+    """
+    def __init__(self, asset_dir: str):
+        self.asset_dir = asset_dir
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def map(self, filename: str) -> memoryview:
+        with self._lock:
+            mapped = self._maps.get(filename)
+            if mapped is None:
+                with open(os.path.join(self.asset_dir, filename), 'rb') as f:
+                    mapped = self._maps[filename] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)
+
+    def bin_pack(self, filename: str) -> ViewBinPack:
+        return ViewBinPack(self.map(filename))
+
+    def dungeon_bin(self, filename: str = "dungeon.bin") -> ViewDungeonBinPack:
+        return ViewDungeonBinPack(self.map(filename), STATIC_DATA.dungeon_data.dungeon_bin_files)
+
+    def close(self):
+        """Closes all maps. Drop the packs returned by this store first, they can not be used afterwards."""
+        with self._lock:
+            maps, self._maps = self._maps, {}
+        for filename, mapped in maps.items():
+            try:
+                mapped.close()
+            except BufferError:
+                # Entries are still referenced somewhere. The map is closed when the last of them is released.
+                logger.warning(f"{filename} is still in use and stays mapped until it is released.")
+
+
+class SurfaceCache(LruCache[tuple, Tuple[cairo.Surface, int, int, int, int]]):
+    """
+    Bounded LRU cache of ready-to-paint sprites, as returned by the `SpriteProvider.get_*` methods:
+    (surface, x, y, w, h). The budget is the total size of the cached surfaces' pixel buffers in bytes.
+    Sprites of the pre-rendered sheets share the sheet's buffer and are counted by their area. The sheets themselves
+    are not part of this budget, `SpriteSheets` keeps them within its own. A sheet dropped there stays in memory
+    until its sprites are evicted from here.
+    """
+    def put(
+            self, key: tuple, value: Tuple[cairo.Surface, int, int, int, int], size: Optional[int] = None
+    ) -> Tuple[cairo.Surface, int, int, int, int]:
+        if size is None:
+            surface = value[0]
+            if isinstance(surface, cairo.ImageSurface):
+                size = surface.get_stride() * surface.get_height()
+            else:
+                # Sprites of a sprite sheet share the sheet's buffer, they are counted by their area
+                size = value[3] * value[4] * 4
+        return super().put(key, value, size)
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self),
+            'bytes': self.size,
+            'max_bytes': self.max_size,
+        }
+
+
+# Pre-rendered sprite sheets, written by the ROM extraction
+SPRITE_SHEET_WIDTH = 1024
+SPRITE_SHEET_MAX_HEIGHT = 1024
+SPRITE_SHEET_INDEX = 'index.json'
+# Decoded sheets kept in memory per set of sheets, room for four full sheets (4 MiB each)
+SPRITE_SHEET_CACHE_BYTES = 16 * 1024 * 1024
+MONSTER_ATLAS_DIR = 'monster_atlas'
+# Items (key "item/<sprite>/<palette>") and traps (key "trap/<trap id>")
+ITEM_TRAP_SHEETS_DIR = 'item_trap_sheets'
+# Directions of the monster sprites (ssa_id 1-8). Direction 0 is drawn like direction 1.
+MONSTER_DIRECTIONS = range(1, 9)
+
+
+def pack_sprite_sheets(frames: Dict[str, Image.Image]) -> Tuple[List[np.ndarray], Dict[str, List[int]]]:
+    """
+    Packs the RGBA images into as few sheets as possible (in rows of images of similar height).
+    Returns the sheets as premultiplied BGRA arrays and the [sheet, x, y, w, h] of every image.
+    """
+    width = max([SPRITE_SHEET_WIDTH] + [im.width for im in frames.values()])
+    placements: Dict[str, List[int]] = {}
+    heights = [0]
+    x = y = row_height = 0
+    for key in sorted(frames, key=lambda k: (-frames[k].height, k)):
+        w, h = frames[key].size
+        if x + w > width:
+            x, y, row_height = 0, y + row_height, 0
+        if y + h > SPRITE_SHEET_MAX_HEIGHT and y > 0:
+            heights.append(0)
+            x = y = row_height = 0
+        placements[key] = [len(heights) - 1, x, y, w, h]
+        heights[-1] = max(heights[-1], y + h)
+        x += w
+        row_height = max(row_height, h)
+
+    sheets = [np.zeros((height, width, 4), dtype=np.uint8) for height in heights]
+    for key, (sheet, x, y, w, h) in placements.items():
+        rgba = np.asarray(frames[key].convert('RGBA'))
+        premultiply_bgra(rgba, out=sheets[sheet][y:y + h, x:x + w])
+    return sheets, placements
+
+
+def write_sprite_sheets(
+        out_path: str, directory: str, frames: Dict[str, Image.Image], extra: Optional[Dict[str, list]] = None
+) -> List[str]:
+    """
+    Writes the images as zlib-compressed premultiplied ARGB32 sheets into `directory`, together with an index
+    of the [sheet, x, y, w, h, *extra[key]] of every image. Returns the paths of the written files.
+    """
+    extra = extra or {}
+    sheets, placements = pack_sprite_sheets(frames)
+    path = os.path.join(out_path, directory)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    relpaths = []
+    index = {
+        'sheets': [],
+        'sprites': {key: placement + list(extra.get(key, [])) for key, placement in placements.items()},
+    }
+    for i, sheet in enumerate(sheets):
+        fn = f"sheet_{i}.bin"
+        write_file_atomic(os.path.join(path, fn), zlib.compress(sheet.tobytes(), 6))
+        index['sheets'].append({'file': fn, 'width': sheet.shape[1], 'height': sheet.shape[0]})
+        relpaths.append(os.path.join(directory, fn))
+    write_file_atomic(os.path.join(path, SPRITE_SHEET_INDEX), json.dumps(index, sort_keys=True).encode())
+    relpaths.append(os.path.join(directory, SPRITE_SHEET_INDEX))
+    return relpaths
+
+
+class SpriteSheets:
+    """
+    Sprite sheets written by `write_sprite_sheets`. The index is read on first use, every sheet when a sprite on it
+    is requested. The decoded sheets are kept in an LRU cache of `max_bytes`. The sprites are not cached here,
+    `SpriteProvider` keeps them in its `SurfaceCache`. Whether the sheets exist is only checked once, when this is
+    created.
+    """
+    def __init__(self, path: str, max_bytes: int = SPRITE_SHEET_CACHE_BYTES):
+        self.path = path
+        self.available = os.path.exists(os.path.join(path, SPRITE_SHEET_INDEX))
+        self._index: Optional[dict] = None
+        self._sheets: LruCache[int, cairo.ImageSurface] = LruCache(max_bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[cairo.Surface, list]]:
+        """The sprite (a sub-surface of its sheet) and its index entry, or None if the sheets do not contain it."""
+        with self._lock:
+            if self._index is None:
+                with open(os.path.join(self.path, SPRITE_SHEET_INDEX), 'r') as f:
+                    self._index = json.load(f)
+        entry = self._index['sprites'].get(key)
+        if entry is None:
+            return None
+        sheet, x, y, w, h = entry[:5]
+        return self._sheet(sheet).create_for_rectangle(x, y, w, h), entry
+
+    def _sheet(self, i: int) -> cairo.ImageSurface:
+        surface = self._sheets.get(i)
+        if surface is None:
+            info = self._index['sheets'][i]
+            with open(os.path.join(self.path, info['file']), 'rb') as f:
+                data = bytearray(zlib.decompress(f.read()))
+            surface = cairo.ImageSurface.create_for_data(
+                data, cairo.FORMAT_ARGB32, info['width'], info['height'], info['width'] * 4
+            )
+            surface = self._sheets.put(i, surface, len(data))
+        return surface
+
+
+def item_sprite_rgba(items: ImgItm, sprite: int, palette: int) -> np.ndarray:
+    """The item sprite as RGBA pixels. The first color of every palette is transparent."""
+    img = items.to_pil(sprite, palette)
+    rgba = np.array(img.convert('RGBA'))
+    rgba[..., 3] = np.where(np.asarray(img) % 16 != 0, 255, 0)
+    return rgba
+
+
 class SpriteProvider:
-    def __init__(self):
-        with open(os.path.join(asset_path(), "dungeon.bin"), "rb") as f:
-            self.dungeon_bin: DungeonBinPack = FileType.DUNGEON_BIN.deserialize(f.read(), static_data=STATIC_DATA)
-        with open(os.path.join(asset_path(), "item_p.bin"), "rb") as f:
-            self.item_p: ItemPProtocol = FileType.ITEM_P.deserialize(f.read())
-        with open(os.path.join(asset_path(), "monster.md"), "rb") as f:
-            self.monster_md: MdProtocol = FileType.MD.deserialize(f.read())
-        with open(os.path.join(asset_path(), "monster.bin"), "rb") as f:
-            self.monster_bin: BinPack = FileType.BIN_PACK.deserialize(f.read())
+    """
+    Provides the sprites for monsters, items and traps.
+
+    The underlying archives are only read and deserialized when a sprite that needs them is first requested,
+    so eg. monster.bin is never loaded when rendering with +nomonsters. Use `SpriteProvider.shared()` to get the
+    process-wide instance instead of building a new provider per render.
+    """
+    _shared: Optional['SpriteProvider'] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, asset_dir: Optional[str] = None, cache_bytes: int = SPRITE_CACHE_BYTES):
+        self.asset_dir = asset_dir if asset_dir is not None else asset_path()
+        self.surface_cache = SurfaceCache(cache_bytes)
+        self.assets = AssetStore(self.asset_dir)
+        self.monster_atlas = SpriteSheets(os.path.join(self.asset_dir, MONSTER_ATLAS_DIR))
+        self.item_trap_sheets = SpriteSheets(os.path.join(self.asset_dir, ITEM_TRAP_SHEETS_DIR))
+        self._lock = threading.RLock()
+        self._dungeon_bin: Optional[DungeonBinPack] = None
+        self._item_p: Optional[ItemPProtocol] = None
+        self._monster_md: Optional[MdProtocol] = None
+        self._monster_bin: Optional[BinPack] = None
+
+    @classmethod
+    def shared(cls) -> 'SpriteProvider':
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    def reload(self, asset_dir: Optional[str] = None):
+        """
+        Drops all loaded archives and the cached tilesets, eg. after a ROM was extracted again.
+        They are read again from `asset_dir` (if given) on next use.
+        """
+        TILESET_CACHE.clear()
+        with self._lock:
+            if asset_dir is not None:
+                self.asset_dir = asset_dir
+            old_assets = self.assets
+            self.assets = AssetStore(self.asset_dir)
+            self.monster_atlas = SpriteSheets(os.path.join(self.asset_dir, MONSTER_ATLAS_DIR))
+            self.item_trap_sheets = SpriteSheets(os.path.join(self.asset_dir, ITEM_TRAP_SHEETS_DIR))
+            self._dungeon_bin = None
+            self._item_p = None
+            self._monster_md = None
+            self._monster_bin = None
+            self.surface_cache.clear()
+            # Unmap the old files, so they can be replaced (Windows does not allow that while they are mapped)
+            old_assets.close()
+
+    def _read_asset(self, filename: str) -> bytes:
+        with open(os.path.join(self.asset_dir, filename), "rb") as f:
+            return f.read()
+
+    @property
+    def dungeon_bin(self) -> DungeonBinPack:
+        if self._dungeon_bin is None:
+            with self._lock:
+                if self._dungeon_bin is None:
+                    self._dungeon_bin = self.assets.dungeon_bin()
+        return self._dungeon_bin
+
+    @property
+    def item_p(self) -> ItemPProtocol:
+        if self._item_p is None:
+            with self._lock:
+                if self._item_p is None:
+                    self._item_p = FileType.ITEM_P.deserialize(self._read_asset("item_p.bin"))
+        return self._item_p
+
+    @property
+    def monster_md(self) -> MdProtocol:
+        if self._monster_md is None:
+            with self._lock:
+                if self._monster_md is None:
+                    self._monster_md = FileType.MD.deserialize(self._read_asset("monster.md"))
+        return self._monster_md
+
+    @property
+    def monster_bin(self) -> BinPack:
+        if self._monster_bin is None:
+            with self._lock:
+                if self._monster_bin is None:
+                    self._monster_bin = self.assets.bin_pack("monster.bin")
+        return self._monster_bin
 
     def get_monster(self, md_index, direction_id: int):
-        pil_img, cx, cy, w, h = self._retrieve_monster_sprite(md_index, direction_id)
-        surf = pil_to_cairo_surface(pil_img)
-        return surf, cx, cy, w, h
+        key = ('monster', md_index, direction_id)
+        cached = self.surface_cache.get(key)
+        if cached is not None:
+            return cached
+        return self.surface_cache.put(key, self._retrieve_monster_sprite(md_index, direction_id))
 
     def get_for_trap(self, trp: Union[MappaTrapType, int]):
-        traps: ImgTrp = self.dungeon_bin.get(TRP_FILENAME)
-        surf = pil_to_cairo_surface(traps.to_pil(trp, TRAP_PALETTE_MAP[trp]).convert('RGBA'))
-        return surf, 0, 0, 24, 24
+        key = ('trap', trp, TRAP_PALETTE_MAP[trp])
+        cached = self.surface_cache.get(key)
+        if cached is not None:
+            return cached
+        surf = self._surface_from_sheets(f"trap/{trp}")
+        if surf is None:
+            traps: ImgTrp = self.dungeon_bin.get(TRP_FILENAME)
+            surf = pil_to_cairo_surface(traps.to_pil(trp, TRAP_PALETTE_MAP[trp]).convert('RGBA'))
+        return self.surface_cache.put(key, (surf, 0, 0, 24, 24))
 
     def get_for_item(self, item_id):
         item = self.item_p.item_list[item_id]
-        items: ImgItm = self.dungeon_bin.get(ITM_FILENAME)
-        img = items.to_pil(item.sprite, item.palette)
-        alpha = [px % 16 != 0 for px in img.getdata()]
-        img = img.convert('RGBA')
-        alphaimg = Image.new('1', (img.width, img.height))
-        alphaimg.putdata(alpha)
-        img.putalpha(alphaimg)
-        surf = pil_to_cairo_surface(img)
-        return surf, 0, 0, 16, 16
-
-    def _retrieve_monster_sprite(self, md_index, direction_id: int) -> Tuple[Image.Image, int, int, int, int]:
+        key = ('item', item.sprite, item.palette)
+        cached = self.surface_cache.get(key)
+        if cached is not None:
+            return cached
+        surf = self._surface_from_sheets(f"item/{item.sprite}/{item.palette}")
+        if surf is None:
+            items: ImgItm = self.dungeon_bin.get(ITM_FILENAME)
+            surf = rgba_to_cairo_surface(item_sprite_rgba(items, item.sprite, item.palette))
+        return self.surface_cache.put(key, (surf, 0, 0, 16, 16))
+
+    def _surface_from_sheets(self, key: str) -> Optional[cairo.ImageSurface]:
+        """
+        Copy of a sprite of the pre-rendered item and trap sheets, or None if there are no sheets (older extraction).
+        The sprites are copied out of the sheet, so they can be drawn as repeating patterns.
+        """
+        if not self.item_trap_sheets.available:
+            return None
+        found = self.item_trap_sheets.get(key)
+        if found is None:
+            return None
+        sprite, entry = found
+        w, h = entry[3:5]
+        surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        ctx = cairo.Context(surf)
+        ctx.set_operator(cairo.Operator.SOURCE)
+        ctx.set_source_surface(sprite, 0, 0)
+        ctx.paint()
+        surf.flush()
+        return surf
+
+    def get_tile_for_item(self, item_id, buried=False):
+        """The item sprite centered on a transparent tile, at half opacity if buried."""
+        item = self.item_p.item_list[item_id]
+        key = ('item_tile', item.sprite, item.palette, buried)
+        cached = self.surface_cache.get(key)
+        if cached is not None:
+            return cached
+        sprite, x, y, w, h = self.get_for_item(item_id)
+        surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, CHUNK_DIM, CHUNK_DIM)
+        ctx = cairo.Context(surf)
+        ctx.set_source_surface(sprite, (CHUNK_DIM - w) // 2, (CHUNK_DIM - h) // 2)
+        if buried:
+            ctx.paint_with_alpha(0.5)
+        else:
+            ctx.paint()
+        surf.flush()
+        return self.surface_cache.put(key, (surf, 0, 0, CHUNK_DIM, CHUNK_DIM))
+
+    def _retrieve_monster_sprite(self, md_index, direction_id: int) -> Tuple[cairo.Surface, int, int, int, int]:
         try:
             actor_sprite_id = self.monster_md[md_index].sprite_index
             if actor_sprite_id < 0:
                 raise ValueError("Invalid Sprite index")
+            if self.monster_atlas.available:
+                found = self.monster_atlas.get(f"{actor_sprite_id}/{direction_id if direction_id > 0 else 1}")
+                if found is not None:
+                    surf, (_, _, _, w, h, cx, cy) = found
+                    return surf, cx, cy, w, h
+            # Not pre-rendered (older extraction or a sprite the extraction could not render)
             sprite = self._load_sprite_from_bin_pack(self.monster_bin, actor_sprite_id)
-
-            ani_group = sprite.anim_groups[0]
-            frame_id = direction_id - 1 if direction_id > 0 else 0
-            mfg_id = ani_group[frame_id].frames[0].frame_id
-
-            sprite_img, (cx, cy) = sprite.render_frame(sprite.frames[mfg_id])
-            return sprite_img, cx, cy, sprite_img.width, sprite_img.height
+            pil_img, cx, cy, w, h = self._render_idle_frame(sprite, direction_id)
+            return pil_to_cairo_surface(pil_img), cx, cy, w, h
         except BaseException as e:
             raise RuntimeError(f"Error loading monster sprite for {md_index}") from e
 
+    @staticmethod
+    def _render_idle_frame(sprite: Wan, direction_id: int) -> Tuple[Image.Image, int, int, int, int]:
+        ani_group = sprite.anim_groups[0]
+        frame_id = direction_id - 1 if direction_id > 0 else 0
+        mfg_id = ani_group[frame_id].frames[0].frame_id
+
+        sprite_img, (cx, cy) = sprite.render_frame(sprite.frames[mfg_id])
+        return sprite_img, cx, cy, sprite_img.width, sprite_img.height
+
     @staticmethod
     def _load_sprite_from_bin_pack(bin_pack: BinPack, file_id) -> Wan:
         return FileType.WAN.deserialize(FileType.COMMON_AT.deserialize(bin_pack[file_id]).decompress())
@@ -592,109 +1860,379 @@ class SpriteProvider:
 ####################################
 
 
-if __name__ == "__main__":
-    # If this is run as a script, it will try to create the file structure for EOS_DUNGEONS_TILESET_PATH
-    # at /assets/dungeon_tiles and then exit. It will use the ROM at /assets/rom.nds as a base for this.
-
-    DUNGEON_BIN = 'DUNGEON/dungeon.bin'
-    ITEM_BIN = 'BALANCE/item_p.bin'
-    MONSTER_MD = 'BALANCE/monster.md'
-    MONSTER_BIN = 'MONSTER/monster.bin'
-    OUT_PATH = os.path.join("assets/dungeon_tiles")
-    NUMBER_OF_TILESETS = 170
-    rom_path= sys.argv[1] if len(sys.argv) > 1 else None
-
-    shutil.rmtree(OUT_PATH, ignore_errors=True)
-    os.makedirs(OUT_PATH)
+# ROM extraction
+# Creates the file structure for the assets at /assets/dungeon_tiles from a ROM.
+DUNGEON_BIN = 'DUNGEON/dungeon.bin'
+ITEM_BIN = 'BALANCE/item_p.bin'
+MONSTER_MD = 'BALANCE/monster.md'
+MONSTER_BIN = 'MONSTER/monster.bin'
+NUMBER_OF_TILESETS = 170
+TILESET_FILE_EXTENSIONS = ('dma', 'dpc', 'dpci', 'dpl', 'dpla')
+
+
+EXTRACTION_MANIFEST_FN = 'manifest.json'
+COMMON_OUTPUTS = ('dungeon.bin', 'item_p.bin', 'monster.md', 'monster.bin') + tuple(
+    f"base.{ext}" for ext in TILESET_FILE_EXTENSIONS
+)
+# The groups of outputs in the manifest, besides one per tileset
+EXTRACTION_OUTPUT_KEYS = ('common', 'monster_atlas', 'item_trap_sheets')
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Path -> (modification time, size, SHA-256) of the ROMs hashed by this process
+_ROM_HASHES: Dict[str, Tuple[int, int, str]] = {}
+
+
+def rom_sha256(rom_path: str) -> str:
+    """The SHA-256 of the ROM. Only computed again when the file's modification time or size changed."""
+    stat = os.stat(rom_path)
+    known = _ROM_HASHES.get(rom_path)
+    if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+        return known[2]
+    digest = _sha256_file(rom_path)
+    _ROM_HASHES[rom_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def _record_outputs(out_path: str, relpaths: List[str]) -> Dict[str, dict]:
+    """The hash, size and modification time of the written outputs, as stored in the manifest."""
+    outputs = {}
+    for relpath in relpaths:
+        path = os.path.join(out_path, relpath)
+        stat = os.stat(path)
+        outputs[relpath] = {'sha256': _sha256_file(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return outputs
+
+
+def _outputs_valid(out_path: str, outputs: Optional[Dict[str, dict]], check_hashes: bool = True) -> bool:
+    """
+    Whether the outputs recorded in the manifest are unchanged. Without `check_hashes` only their sizes and
+    modification times are compared, which is enough to tell if the files were touched since they were written.
+    Outputs recorded by older versions (hashes only) are never valid.
+    """
+    if not outputs:
+        return False
+    for relpath, recorded in outputs.items():
+        if not isinstance(recorded, dict):
+            return False
+        path = os.path.join(out_path, relpath)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if check_hashes:
+            if _sha256_file(path) != recorded['sha256']:
+                return False
+        elif (stat.st_size, stat.st_mtime_ns) != (recorded['size'], recorded['mtime_ns']):
+            return False
+    return True
+
+
+def _read_manifest(out_path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(out_path, EXTRACTION_MANIFEST_FN), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Path -> (manifest modification time, manifest size, ROM hash)
+_EXTRACTED_ROMS: Dict[str, Tuple[int, int, str]] = {}
+
+
+def extracted_rom_sha256(out_path: str = asset_path()) -> str:
+    """
+    The SHA-256 of the ROM the assets in `out_path` were extracted from, or an empty string if there is no
+    extraction manifest. The manifest is only read again when it changed.
+    """
+    try:
+        stat = os.stat(os.path.join(out_path, EXTRACTION_MANIFEST_FN))
+    except OSError:
+        return ''
+    known = _EXTRACTED_ROMS.get(out_path)
+    if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+        return known[2]
+    manifest = _read_manifest(out_path)
+    digest = manifest.get('rom_sha256', '') if manifest is not None else ''
+    _EXTRACTED_ROMS[out_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def _write_manifest(out_path: str, manifest: dict):
+    data = json.dumps(manifest, indent=1, sort_keys=True).encode()
+    write_file_atomic(os.path.join(out_path, EXTRACTION_MANIFEST_FN), data)
+
+
+def is_extraction_complete(rom_path: str, out_path: str = asset_path()) -> bool:
+    """
+    Whether `out_path` contains a complete and unmodified extraction of the ROM at `rom_path`.
+    The outputs are checked by size and modification time only, `extract_rom` compares their hashes.
+    """
+    manifest = _read_manifest(out_path)
+    if manifest is None or not manifest.get('complete') or manifest.get('rom_sha256') != rom_sha256(rom_path):
+        return False
+    # Extractions by older versions lack some outputs
+    if any(key not in manifest['outputs'] for key in EXTRACTION_OUTPUT_KEYS):
+        return False
+    return all(_outputs_valid(out_path, outputs, check_hashes=False) for outputs in manifest['outputs'].values())
+
+
+def _extract_tileset(out_path: str, i: int, files: Tuple[bytes, bytes, bytes, bytes, bytes]) -> Dict[str, str]:
+    """
+    Writes the DTEF files and the precompiled bundle of tileset `i`. `files` are the tileset's
+    dma/dpc/dpci/dpl/dpla as stored in dungeon.bin. Runs in the extraction worker processes.
+    Returns the manifest entries of the written files.
+    """
+    fn = os.path.join(out_path, "dtef", str(i))
+    # Remove leftovers of an interrupted run
+    shutil.rmtree(fn, ignore_errors=True)
+    os.makedirs(fn)
+    dma = FileType.DBIN_SIR0_AT4PX_DMA.deserialize(files[0])
+    dpc = FileType.DBIN_AT4PX_DPC.deserialize(files[1])
+    dpci = FileType.DBIN_AT4PX_DPCI.deserialize(files[2])
+    dpl = FileType.DPL.deserialize(files[3])
+    dpla = FileType.DBIN_SIR0_DPLA.deserialize(files[4])
+
+    dtef = ExplorersDtef(dma, dpc, dpci, dpl, dpla)
+
+    # Write XML
+    xml = ElementTree.tostring(dtef.get_xml(), encoding='unicode')
+    write_file_atomic(os.path.join(fn, 'tileset.dtef.xml'), xml.encode())
+    # Write Tiles
+    var0, var1, var2, rest = dtef.get_tiles()
+    var0fn, var1fn, var2fn, restfn = dtef.get_filenames()
+    for image, image_fn in ((var0, var0fn), (var1, var1fn), (var2, var2fn), (rest, restfn)):
+        png = BytesIO()
+        image.save(png, 'PNG')
+        write_file_atomic(os.path.join(fn, image_fn), png.getvalue())
+
+    # Write precompiled bundle, so rendering does not need to import the DTEF again
+    bundle_relpath = os.path.join(TILESET_BUNDLE_DIR, f"{i}.tsb")
+    write_file_atomic(os.path.join(out_path, bundle_relpath), pack_tileset_bundle(*files))
+
+    return _record_outputs(out_path, [
+        os.path.join("dtef", str(i), x) for x in ('tileset.dtef.xml', var0fn, var1fn, var2fn, restfn)
+    ] + [bundle_relpath])
+
+
+# Number of monster sprites rendered per extraction task
+MONSTER_ATLAS_CHUNK = 32
+
+
+def _render_monster_frames(
+        out_path: str, sprite_ids: List[int]
+) -> List[Tuple[str, Tuple[int, int], bytes, int, int]]:
+    """
+    Renders the idle frame of every direction of the monster sprites, from the extracted monster.bin.
+    Runs in the extraction worker processes. Returns (key, size, RGBA pixels, cx, cy) of every frame.
+    """
+    monster_bin = AssetStore(out_path).bin_pack("monster.bin")
+    frames = []
+    for sprite_id in sprite_ids:
+        try:
+            sprite = SpriteProvider._load_sprite_from_bin_pack(monster_bin, sprite_id)
+        except Exception:
+            logger.warning(f"Could not load monster sprite {sprite_id}, it is rendered at runtime.", exc_info=True)
+            continue
+        for direction_id in MONSTER_DIRECTIONS:
+            try:
+                img, cx, cy, w, h = SpriteProvider._render_idle_frame(sprite, direction_id)
+            except Exception:
+                logger.warning(f"Could not render direction {direction_id} of monster sprite {sprite_id}.")
+                continue
+            img = img.convert('RGBA')
+            frames.append((f"{sprite_id}/{direction_id}", img.size, img.tobytes(), cx, cy))
+    return frames
+
+
+def _write_monster_atlas(out_path: str, frames: List[Tuple[str, Tuple[int, int], bytes, int, int]]) -> Dict[str, dict]:
+    """Packs the frames returned by `_render_monster_frames` into the monster atlas. Returns the manifest entries."""
+    images = {key: Image.frombytes('RGBA', size, data) for key, size, data, _, _ in frames}
+    anchors = {key: [cx, cy] for key, _, _, cx, cy in frames}
+    return _record_outputs(out_path, write_sprite_sheets(out_path, MONSTER_ATLAS_DIR, images, anchors))
+
+
+def _write_item_trap_sheets(out_path: str, dungeon_bin: DungeonBinPack, item_p: ItemPProtocol) -> Dict[str, dict]:
+    """Renders every item sprite/palette pair and every trap into the item and trap sheets. Returns the entries."""
+    items: ImgItm = dungeon_bin.get(ITM_FILENAME)
+    traps: ImgTrp = dungeon_bin.get(TRP_FILENAME)
+    images = {}
+    for sprite, palette in sorted({(x.sprite, x.palette) for x in item_p.item_list}):
+        try:
+            images[f"item/{sprite}/{palette}"] = Image.fromarray(item_sprite_rgba(items, sprite, palette), 'RGBA')
+        except Exception:
+            logger.warning(f"Could not render item sprite {sprite} with palette {palette}.")
+    for trp, palette in TRAP_PALETTE_MAP.items():
+        images[f"trap/{trp}"] = traps.to_pil(trp, palette).convert('RGBA')
+    return _record_outputs(out_path, write_sprite_sheets(out_path, ITEM_TRAP_SHEETS_DIR, images))
+
+
+def extract_rom(
+        rom_path: str, out_path: str = asset_path(), jobs: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None, force: bool = False
+):
+    """
+    Extracts all assets needed for rendering from the ROM into `out_path`.
+    The tilesets are extracted by a pool of `jobs` processes (default: one per CPU, 1 extracts in this process).
+    `progress` is called with (number of finished steps, total number of steps). Every tileset is one step, the
+    monster atlas and the item/trap sheets are one more step each.
+    The output does not depend on the number of jobs.
+
+    A manifest with the hash of the ROM and of every output is kept up to date while extracting. If `out_path`
+    already contains (a partial) extraction of the same ROM, outputs that are still valid are kept and only the
+    rest is extracted. Pass `force` to start from scratch.
+    """
+    rom_hash = rom_sha256(rom_path)
+    manifest = _read_manifest(out_path)
+    if force or manifest is None or manifest.get('rom_sha256') != rom_hash:
+        shutil.rmtree(out_path, ignore_errors=True)
+        manifest = {'rom_sha256': rom_hash, 'complete': False, 'outputs': {}}
+    os.makedirs(out_path, exist_ok=True)
+    outputs: Dict[str, Dict[str, dict]] = manifest['outputs']
+
+    pending_tilesets = [i for i in range(0, NUMBER_OF_TILESETS) if not _outputs_valid(out_path, outputs.get(str(i)))]
+    # The pre-rendered monster sprites and the item/trap sheets count as one more step each
+    total = NUMBER_OF_TILESETS + 2
+    common_valid = _outputs_valid(out_path, outputs.get('common'))
+    atlas_valid = common_valid and _outputs_valid(out_path, outputs.get('monster_atlas'))
+    sheets_valid = common_valid and _outputs_valid(out_path, outputs.get('item_trap_sheets'))
+    if common_valid and atlas_valid and sheets_valid and len(pending_tilesets) == 0:
+        if not manifest['complete']:
+            manifest['complete'] = True
+            _write_manifest(out_path, manifest)
+        if progress is not None:
+            progress(total, total)
+        return
+    manifest['complete'] = False
+    _write_manifest(out_path, manifest)
+
     rom = NintendoDSRom.fromFile(rom_path)
+    dungeon_bin_bytes = rom.getFileByName(DUNGEON_BIN)
+    # Only the files that are extracted are copied out of the pack
+    dungeon_bin = ViewDungeonBinPack(dungeon_bin_bytes, STATIC_DATA.dungeon_data.dungeon_bin_files)
+
+    # Index the pack once, instead of scanning all of its files for every lookup
+    dungeon_bin_files = dungeon_bin.get_files_bytes()
+    dungeon_bin_index = {dungeon_bin.get_filename(i): i for i in range(0, len(dungeon_bin_files))}
+
+    def dungeon_bin_file_bytes(name: str) -> bytes:
+        return dungeon_bin_files[dungeon_bin_index[name]].tobytes()
+
+    if not _outputs_valid(out_path, outputs.get('common')):
+        # All files are replaced instead of overwritten in place, as running renderers may have them memory-mapped.
+        # /dungeon.bin
+        write_file_atomic(os.path.join(out_path, "dungeon.bin"), dungeon_bin_bytes)
+
+        # /base.*
+        for ext in TILESET_FILE_EXTENSIONS:
+            write_file_atomic(os.path.join(out_path, f"base.{ext}"), dungeon_bin_file_bytes(f"dungeon0.{ext}"))
+
+        # /item_p.bin
+        write_file_atomic(os.path.join(out_path, "item_p.bin"), rom.getFileByName(ITEM_BIN))
+
+        # /monster.md
+        write_file_atomic(os.path.join(out_path, "monster.md"), rom.getFileByName(MONSTER_MD))
+
+        # /monster.bin
+        write_file_atomic(os.path.join(out_path, "monster.bin"), rom.getFileByName(MONSTER_BIN))
+
+        outputs['common'] = _record_outputs(out_path, list(COMMON_OUTPUTS))
+        _write_manifest(out_path, manifest)
+
+    # /dtef/x/ and /bundles/x.tsb
+    os.makedirs(os.path.join(out_path, TILESET_BUNDLE_DIR), exist_ok=True)
+    tasks = [
+        (out_path, i, tuple(dungeon_bin_file_bytes(f'dungeon{i}.{ext}') for ext in TILESET_FILE_EXTENSIONS))
+        for i in pending_tilesets
+    ]
+    # /monster_atlas/
+    monster_tasks = []
+    if not atlas_valid:
+        monster_md = FileType.MD.deserialize(rom.getFileByName(MONSTER_MD))
+        number_of_sprites = len(AssetStore(out_path).bin_pack("monster.bin"))
+        sprite_ids = sorted({x.sprite_index for x in monster_md.entries if 0 <= x.sprite_index < number_of_sprites})
+        monster_tasks = [
+            (out_path, sprite_ids[i:i + MONSTER_ATLAS_CHUNK]) for i in range(0, len(sprite_ids), MONSTER_ATLAS_CHUNK)
+        ] or [(out_path, [])]
+    monster_frames = []
+    monster_tasks_left = len(monster_tasks)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    done = total - len(tasks) - (0 if atlas_valid else 1) - (0 if sheets_valid else 1)
+    if progress is not None:
+        progress(done, total)
+
+    def step_done():
+        nonlocal done
+        # The manifest is written after every step, so an interrupted run can be resumed.
+        _write_manifest(out_path, manifest)
+        done += 1
+        if progress is not None:
+            progress(done, total)
+
+    def tileset_done(i: int, entries: Dict[str, dict]):
+        outputs[str(i)] = entries
+        step_done()
+
+    def monster_frames_done(frames):
+        nonlocal monster_tasks_left
+        # The atlas is packed once all sprites are rendered
+        monster_frames.extend(frames)
+        monster_tasks_left -= 1
+        if monster_tasks_left == 0:
+            outputs['monster_atlas'] = _write_monster_atlas(out_path, monster_frames)
+            step_done()
+
+    # /item_trap_sheets/
+    if not sheets_valid:
+        outputs['item_trap_sheets'] = _write_item_trap_sheets(
+            out_path, dungeon_bin, FileType.ITEM_P.deserialize(rom.getFileByName(ITEM_BIN))
+        )
+        step_done()
+
+    if jobs <= 1:
+        for task in tasks:
+            tileset_done(task[1], _extract_tileset(*task))
+        for task in monster_tasks:
+            monster_frames_done(_render_monster_frames(*task))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(_extract_tileset, *task): task[1] for task in tasks}
+            monster_futures = [executor.submit(_render_monster_frames, *task) for task in monster_tasks]
+            for future in as_completed(list(futures) + monster_futures):
+                if future in futures:
+                    tileset_done(futures[future], future.result())
+                else:
+                    monster_frames_done(future.result())
+
+    manifest['complete'] = True
+    _write_manifest(out_path, manifest)
 
-    # /dungeon.bin
-    with open(os.path.join(OUT_PATH, "dungeon.bin"), "wb") as f:
-        dungeon_bin_bytes = rom.getFileByName(DUNGEON_BIN)
-        f.write(dungeon_bin_bytes)
-        dungeon_bin = FileType.DUNGEON_BIN.deserialize(dungeon_bin_bytes, STATIC_DATA)
-
-    # /base.dma
-    with open(os.path.join(OUT_PATH, "base.dma"), "wb") as f:
-        ok = False
-        for i in range(0, len(dungeon_bin.get_files_bytes())):
-            if "dungeon0.dma" == dungeon_bin.get_filename(i):
-                f.write(dungeon_bin.get_files_bytes()[i])
-                ok = True
-                break
-        assert ok
-
-    # /base.dpc
-    with open(os.path.join(OUT_PATH, "base.dpc"), "wb") as f:
-        ok = False
-        for i in range(0, len(dungeon_bin.get_files_bytes())):
-            if "dungeon0.dpc" == dungeon_bin.get_filename(i):
-                f.write(dungeon_bin.get_files_bytes()[i])
-                ok = True
-                break
-        assert ok
-
-    # /base.dpci
-    with open(os.path.join(OUT_PATH, "base.dpci"), "wb") as f:
-        ok = False
-        for i in range(0, len(dungeon_bin.get_files_bytes())):
-            if "dungeon0.dpci" == dungeon_bin.get_filename(i):
-                f.write(dungeon_bin.get_files_bytes()[i])
-                ok = True
-                break
-        assert ok
-
-    # /base.dpl
-    with open(os.path.join(OUT_PATH, "base.dpl"), "wb") as f:
-        ok = False
-        for i in range(0, len(dungeon_bin.get_files_bytes())):
-            if "dungeon0.dpl" == dungeon_bin.get_filename(i):
-                f.write(dungeon_bin.get_files_bytes()[i])
-                ok = True
-                break
-        assert ok
-
-    # /base.dpla
-    with open(os.path.join(OUT_PATH, "base.dpla"), "wb") as f:
-        ok = False
-        for i in range(0, len(dungeon_bin.get_files_bytes())):
-            if "dungeon0.dpla" == dungeon_bin.get_filename(i):
-                f.write(dungeon_bin.get_files_bytes()[i])
-                ok = True
-                break
-        assert ok
-
-    # /item_p.bin
-    with open(os.path.join(OUT_PATH, "item_p.bin"), "wb") as f:
-        f.write(rom.getFileByName(ITEM_BIN))
-
-    # /monster.md
-    with open(os.path.join(OUT_PATH, "monster.md"), "wb") as f:
-        f.write(rom.getFileByName(MONSTER_MD))
-
-    # /monster.bin
-    with open(os.path.join(os.path.join(OUT_PATH), "monster.bin"), "wb") as f:
-        f.write(rom.getFileByName(MONSTER_BIN))
-
-    # /dtef/x/
-    for i in range(0, NUMBER_OF_TILESETS):
-        fn = os.path.join(OUT_PATH, "dtef", str(i))
-        os.makedirs(fn)
-        dma = dungeon_bin.get(f'dungeon{i}.dma')
-        dpc = dungeon_bin.get(f'dungeon{i}.dpc')
-        dpci = dungeon_bin.get(f'dungeon{i}.dpci')
-        dpl = dungeon_bin.get(f'dungeon{i}.dpl')
-        dpla = dungeon_bin.get(f'dungeon{i}.dpla')
-
-        dtef = ExplorersDtef(dma, dpc, dpci, dpl, dpla)
-
-        # Write XML
-        with open(os.path.join(fn, 'tileset.dtef.xml'), 'w') as f:
-            f.write(ElementTree.tostring(dtef.get_xml(), encoding='unicode'))
-        # Write Tiles
-        var0, var1, var2, rest = dtef.get_tiles()
-        var0fn, var1fn, var2fn, restfn = dtef.get_filenames()
-        var0.save(os.path.join(fn, var0fn))
-        var1.save(os.path.join(fn, var1fn))
-        var2.save(os.path.join(fn, var2fn))
-        rest.save(os.path.join(fn, restfn))
+
+####################################
+
+
+if __name__ == "__main__":
+    # If this is run as a script, it will try to create the file structure for EOS_DUNGEONS_TILESET_PATH
+    # at /assets/dungeon_tiles and then exit. It will use the ROM given as the first argument as a base for this.
+    # While extracting, a line "PROGRESS <done>/<total>" is printed after every finished step.
+    parser = argparse.ArgumentParser(description="Extract the dungeon rendering assets from an EoS ROM.")
+    parser.add_argument('rom_path')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Number of processes used to extract the tilesets (default: number of CPUs).")
+    parser.add_argument('--force', action='store_true',
+                        help="Extract everything again, even if the existing outputs are valid.")
+    args = parser.parse_args()
+
+    extract_rom(
+        args.rom_path, jobs=args.jobs, force=args.force,
+        progress=lambda done, total: print(f"PROGRESS {done}/{total}", flush=True)
+    )
@@ -0,0 +1,65 @@
+"""The NumPy autotiler (`dma_neighbor_masks`, `dma_mappings`) against skytemple_files' DmaDrawer."""
+import numpy as np
+import pytest
+
+from skytemple_files.graphics.dma.dma_drawer import DmaDrawer
+from skytemple_files.graphics.dma.protocol import DmaType
+from skytemple_files.graphics.dma.util import get_tile_neighbors
+
+from specific.eos_dungeons import dma_neighbor_masks, dma_mappings, DMA_TYPES
+
+GRID_SHAPES = [(1, 1), (1, 7), (6, 1), (5, 5), (32, 56), (42, 66)]
+
+
+class FakeDma:
+    """Stands in for a tileset's DMA: The chunk of every (type, mask, variation) is a distinct number."""
+    def get(self, typ, mask):
+        return [(typ * 256 + mask) * 3 + variation for variation in range(3)]
+
+
+def random_grid(seed: int, shape) -> np.ndarray:
+    return np.random.default_rng(seed).choice(np.array(DMA_TYPES, dtype=np.uint8), size=shape)
+
+
+def reference_masks(grid: np.ndarray, treat_outside_as_wall: bool):
+    # Same as DmaDrawer.get_mappings_for_rules
+    rules = grid.tolist()
+    wall_matrix = [[cell == DmaType.WALL for cell in row] for row in rules]
+    water_matrix = [[cell == DmaType.WATER for cell in row] for row in rules]
+    return [
+        [
+            get_tile_neighbors(
+                water_matrix if cell == DmaType.WATER else wall_matrix, x, y, cell != DmaType.FLOOR,
+                treat_outside_as_wall
+            )
+            for x, cell in enumerate(row)
+        ]
+        for y, row in enumerate(rules)
+    ]
+
+
+@pytest.mark.parametrize("treat_outside_as_wall", [True, False])
+@pytest.mark.parametrize("shape", GRID_SHAPES)
+@pytest.mark.parametrize("seed", range(5))
+def test_neighbor_masks_match_get_tile_neighbors(seed, shape, treat_outside_as_wall):
+    grid = random_grid(seed, shape)
+    assert dma_neighbor_masks(grid, treat_outside_as_wall).tolist() == reference_masks(grid, treat_outside_as_wall)
+
+
+@pytest.mark.parametrize("typ", DMA_TYPES)
+@pytest.mark.parametrize("treat_outside_as_wall", [True, False])
+def test_neighbor_masks_of_uniform_grids(typ, treat_outside_as_wall):
+    grid = np.full((4, 5), typ, dtype=np.uint8)
+    assert dma_neighbor_masks(grid, treat_outside_as_wall).tolist() == reference_masks(grid, treat_outside_as_wall)
+
+
+@pytest.mark.parametrize("variation_index", range(3))
+@pytest.mark.parametrize("shape", GRID_SHAPES)
+@pytest.mark.parametrize("seed", range(3))
+def test_mappings_match_dma_drawer(seed, shape, variation_index):
+    dma = FakeDma()
+    grid = random_grid(seed, shape)
+    expected = DmaDrawer(dma).get_mappings_for_rules(
+        grid.tolist(), variation_index=variation_index, treat_outside_as_wall=True
+    )
+    assert dma_mappings(dma, grid, variation_index).tolist() == expected
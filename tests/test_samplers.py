@@ -0,0 +1,72 @@
+"""The per-floor samplers against the linear scans of the original `generate_floor`."""
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from skytemple_files.dungeon_data.mappa_bin.protocol import GUARANTEED, POKE_ID
+
+from specific.eos_dungeons import WeightedSampler, ItemSampler, ITEM_CATEGORIES
+
+# Includes the lowest and highest random numbers and the weights themselves
+RIDX_VALUES = list(range(0, 10000, 7)) + [9999]
+
+
+def linear_scan(entries, ridx, fallback):
+    for value, weight in entries:
+        if weight > ridx and weight != 0:
+            return value
+    return fallback
+
+
+def linear_scan_item(item_list, ridx_cat, ridx_itm):
+    last_cat = 6
+    for c, prop in item_list.categories.items():
+        if prop > ridx_cat and prop != 0:
+            last_cat = c
+            break
+    for itm, prop in item_list.items.items():
+        if prop > ridx_itm and prop != GUARANTEED and prop != 0 and itm in ITEM_CATEGORIES[last_cat].item_ids():
+            return itm
+    return POKE_ID
+
+
+def random_weights(rng: random.Random, count: int, sorted_weights: bool):
+    weights = [rng.choice([0, rng.randrange(0, 10001)]) for _ in range(count)]
+    if sorted_weights:
+        weights.sort()
+    return weights
+
+
+@pytest.mark.parametrize("sorted_weights", [True, False])
+@pytest.mark.parametrize("seed", range(20))
+def test_weighted_sampler_matches_linear_scan(seed, sorted_weights):
+    rng = random.Random(seed)
+    entries = list(zip(range(100, 200), random_weights(rng, rng.randrange(0, 30), sorted_weights)))
+    sampler = WeightedSampler(entries)
+    for ridx in RIDX_VALUES + [w for _, w in entries]:
+        assert sampler.find(ridx, 383) == linear_scan(entries, ridx, 383)
+
+
+def test_weighted_sampler_without_entries():
+    assert WeightedSampler([]).find(0, 383) == 383
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_item_sampler_matches_linear_scan(seed):
+    rng = random.Random(seed)
+    categories = sorted(ITEM_CATEGORIES)
+    all_items = sorted({itm for c in categories for itm in ITEM_CATEGORIES[c].item_ids()})
+    item_ids = rng.sample(all_items, min(len(all_items), 60))
+    item_weights = random_weights(rng, len(item_ids), True)
+    # Some guaranteed items, which are never sampled
+    for i in rng.sample(range(len(item_ids)), 5):
+        item_weights[i] = GUARANTEED
+    item_list = SimpleNamespace(
+        categories=dict(zip(categories, random_weights(rng, len(categories), True))),
+        items=dict(zip(item_ids, item_weights)),
+    )
+    sampler = ItemSampler(item_list)
+    for _ in range(2000):
+        ridx_cat, ridx_itm = rng.randrange(0, 10000), rng.randrange(0, 10000)
+        assert sampler.find(ridx_cat, ridx_itm) == linear_scan_item(item_list, ridx_cat, ridx_itm)
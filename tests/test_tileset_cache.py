@@ -0,0 +1,57 @@
+"""The disk tier of `TilesetCache`."""
+import os
+
+import pytest
+
+import specific.eos_dungeons as eos_dungeons
+from specific.eos_dungeons import TilesetCache
+
+
+@pytest.fixture(autouse=True)
+def bytes_tilesets(monkeypatch):
+    # Real tilesets need the extracted ROM, the cache only needs them to round-trip through a bundle.
+    monkeypatch.setattr(eos_dungeons, 'serialize_tileset', lambda tileset: b''.join(tileset))
+    monkeypatch.setattr(eos_dungeons, 'deserialize_tileset', lambda data: tuple(bytes([x]) for x in data))
+
+
+TILESET = (b'a', b'b', b'c', b'd', b'e')
+
+
+def loader_returning(tileset, calls):
+    def loader():
+        calls.append(1)
+        return tileset
+    return loader
+
+
+def test_memory_only_without_cache_dir(tmp_path):
+    calls = []
+    cache = TilesetCache()
+    assert cache.get('key', loader_returning(TILESET, calls)) == TILESET
+    assert cache.get('key', loader_returning(TILESET, calls)) == TILESET
+    assert len(calls) == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+    assert os.listdir(tmp_path) == []
+
+
+def test_persisted_tilesets_survive_restarts(tmp_path):
+    calls = []
+    TilesetCache(cache_dir=str(tmp_path / 'tilesets')).get('key', loader_returning(TILESET, calls))
+    assert os.listdir(tmp_path / 'tilesets') == ['key.tsb']
+
+    restarted = TilesetCache(cache_dir=str(tmp_path / 'tilesets'))
+    assert restarted.get('key', loader_returning(None, calls)) == TILESET
+    assert len(calls) == 1
+
+
+def test_unreadable_files_are_imported_again(tmp_path, monkeypatch):
+    calls = []
+    cache = TilesetCache(cache_dir=str(tmp_path))
+    cache.get('key', loader_returning(TILESET, calls))
+    cache.clear()
+
+    def broken(data):
+        raise ValueError("Not a tileset bundle.")
+    monkeypatch.setattr(eos_dungeons, 'deserialize_tileset', broken)
+    assert cache.get('key', loader_returning(TILESET, calls)) == TILESET
+    assert len(calls) == 2